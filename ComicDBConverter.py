@@ -1,70 +1,137 @@
 import tkinter as tk
-from cr_converter import CRConverter
-from tkinter import filedialog, messagebox
+from cr_config import CONFIG_FILE, compress_path, load_config, read_paths, read_flag, read_options, split_paths
 from tkinter import ttk  # Voor de voortgangsbalk
 import configparser
-import os, logging
+import os, sys, logging
+import collections
+import queue
+import threading
 
+# De converter, de logging handlers en de dialogen worden pas geïmporteerd als ze nodig zijn, zodat
+# het venster snel verschijnt. Meet de opstarttijd met startup_benchmark.py.
 
-# Configureer het pad naar je configuratiebestand
-CONFIG_FILE = 'ComicDBConverter.ini'
+# Naam van de logger van de converter (cr_converter), zonder de module al te importeren
+CONVERTER_LOGGER = 'cr_converter'
+
+# Met deze environment variabele toont de GUI het venster en stopt direct, voor startup_benchmark.py
+STARTUP_CHECK = 'COMICDBCONVERTER_STARTUP_CHECK'
+
+
+# Interval in ms waarmee de GUI de log en voortgang van de conversie verwerkt, en het maximale
+# aantal logregels per keer zodat de GUI blijft reageren
+POLL_INTERVAL = 100
+POLL_MAX_RECORDS = 5000
+
+# Het logvenster toont maximaal LOG_MAX_LINES regels, de volledige log gaat naar een roterend logbestand
+LOG_MAX_LINES = 5000
+LOG_FILE = 'ComicDBConverter.log'
+LOG_FILE_SIZE = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+# Scheidingsteken tussen meerdere YAC databases in het invoerveld
+DB_PATH_SEPARATOR = ';'
 
 # Build datum wordt aangepast tijdens de build
 VERSION = "0.3"
 BUILD_DATUM = "2024.08.31.1639"
 
-def expand_path(path):
-    # Vervang eventuele %AppData% en andere environment variabelen in een pad.
-    return os.path.expandvars(path)
-
-def compress_path(path):
-    # Vervang delen van het pad met bekende omgevingsvariabelen, zoals %AppData%.
-    appdata_path = os.environ.get('APPDATA')
-    if appdata_path and path.startswith(appdata_path):
-        return path.replace(appdata_path, '%AppData%')
-    return path
+class GUIHandler(logging.Handler):
+    # Logt naar een Tk Text widget. Records worden in emit alleen gebufferd; flush() voegt ze in
+    # één keer toe en moet vanuit de Tk thread worden aangeroepen. Het widget houdt maximaal
+    # max_lines regels vast, de oudste regels vallen eraf.
+    def __init__(self, text_widget, max_lines=5000):
+        super().__init__()
+        self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.buffer = collections.deque(maxlen=max_lines)
+
+        self.text_widget.configure(state='disabled')
+        self.text_widget.tag_config('DEBUG', foreground='blue')
+        self.text_widget.tag_config('INFO', foreground='green')
+        self.text_widget.tag_config('WARNING', foreground='orange')
+        self.text_widget.tag_config('ERROR', foreground='red')
+        self.text_widget.tag_config('CRITICAL', foreground='magenta')
+        self.text_widget.tag_config('BOLD', font=('Helvetica', 10, 'bold'))
+
+    def emit(self, record):
+        self.buffer.append((self.format(record) + '\n', (record.levelname, 'BOLD')))
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        # insert accepteert afwisselend tekst en tags, zo gaat de hele buffer er in één keer in
+        chunks = []
+        for text, tags in self.buffer:
+            chunks.extend((text, tags))
+        self.buffer.clear()
+
+        self.text_widget.configure(state='normal')
+        self.text_widget.insert(tk.END, *chunks)
+
+        # verwijder de oudste regels boven het maximum
+        lines = int(self.text_widget.index('end-1c').split('.')[0]) - 1
+        if lines > self.max_lines:
+            self.text_widget.delete('1.0', f'{lines - self.max_lines + 1}.0')
+
+        self.text_widget.configure(state='disabled')
+        self.text_widget.yview(tk.END)
 
 class MainApp:
     def __init__(self, root):
         self.root = root
-        self.width, self.height, self.db_path, self.xml_path, self.x_pos, self.y_pos, self.verbose_bool, self.syncread_bool = self.read_config()
+        self.width, self.height, self.db_path, self.xml_path, self.x_pos, self.y_pos, self.verbose_bool, self.syncread_bool, self.options = self.read_config()
 
         # Zet venstergrootte en positie
         self.root.geometry(f'{self.width}x{self.height}+{self.x_pos}+{self.y_pos}')
         self.root.title(f"Convert ComicRack DB to YACLibrary  v{VERSION} - {BUILD_DATUM}")
 
+        # De conversie draait in een aparte thread; log en voortgang komen via de queue binnen
+        self.worker = None
+        self.worker_error = None
+        self.queue = queue.Queue()
+        self.queue_handler = None       # aangemaakt bij de eerste conversie, zie setup_logging
+        self.cancel_event = threading.Event()
+
         self.build_ui()
 
+        self.formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        self.gui_handler = GUIHandler(self.log_text, LOG_MAX_LINES)
+        self.gui_handler.setFormatter(self.formatter)
+
+    def setup_logging(self):
+        # De log van de converter gaat via de queue naar het logvenster; het logbestand wordt direct
+        # vanuit de worker thread geschreven
+        if self.queue_handler is not None:
+            return
+        import logging.handlers
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_BACKUPS, encoding='utf-8', delay=True)
+        file_handler.setFormatter(self.formatter)
+        logging.getLogger(CONVERTER_LOGGER).addHandler(file_handler)
+
 
     def read_config(self):
-        config = configparser.RawConfigParser()
-        config.read(CONFIG_FILE)
-        
+        config = load_config()
+
         width = config.getint('Window', 'width', fallback=800)
         height = config.getint('Window', 'height', fallback=600)
         x_pos = config.getint('Window', 'x_pos', fallback=100)
         y_pos = config.getint('Window', 'y_pos', fallback=100)
         
-        db_path = expand_path(config.get('Paths', 'db_path', fallback=''))
-        xml_path = expand_path(config.get('Paths', 'xml_path', fallback=''))
-
-        try:
-            verbose_bool = config.getboolean('Options', 'show_query', fallback=False)
-        except Exception as e:
-            verbose_bool = False
-
-        try:
-            syncread_bool = config.getboolean('Options', 'sync_read', fallback=False)
-        except Exception as e:
-            verbose_bool = False
+        db_paths, xml_path = read_paths(config)
+        db_path = f"{DB_PATH_SEPARATOR} ".join(db_paths)
+        verbose_bool = read_flag(config, 'show_query')
+        syncread_bool = read_flag(config, 'sync_read')
+        options = read_options(config)
 
-        return width, height, db_path, xml_path, x_pos, y_pos, verbose_bool, syncread_bool
+        return width, height, db_path, xml_path, x_pos, y_pos, verbose_bool, syncread_bool, options
 
     def save_config(self):
         config = configparser.RawConfigParser()
 
         # Haal de huidige waarden op uit de config (of standaardwaarden als ze er niet zijn)
-        _, _, old_db_path, old_xml_path, _, _, _, _ = self.read_config()
+        _, _, old_db_path, old_xml_path, _, _, _, _, _ = self.read_config()
 
         # Controleer of er een nieuwe waarde is geselecteerd, anders gebruik de oude
         new_db_path = self.db_path_entry.get() or old_db_path
@@ -77,14 +144,16 @@ class MainApp:
             'y_pos': self.root.winfo_y()
         }
 
+        # meerdere databases komen elk op een eigen regel
         config['Paths'] = {
-            'db_path': compress_path(new_db_path),
+            'db_path': "\n".join(compress_path(path) for path in split_paths(new_db_path, DB_PATH_SEPARATOR)),
             'xml_path': compress_path(new_xml_path)
         }
 
         config['Options'] = {
             'show_query': self.verbose_var.get(),
-            'sync_read': self.syncread_var.get()
+            'sync_read': self.syncread_var.get(),
+            **self.options
         }
 
         with open(CONFIG_FILE, 'w') as configfile:
@@ -124,7 +193,7 @@ class MainApp:
         self.debug_checkbutton.grid(row=2, column=2, padx=20, pady=0, sticky="e")
 
         # Invoervelden en knoppen
-        tk.Label(self.root, text="YAC Database location:").grid(row=0, column=0, padx=10, pady=2, sticky="w")
+        tk.Label(self.root, text="YAC Database location(s):").grid(row=0, column=0, padx=10, pady=2, sticky="w")
         self.db_path_entry = tk.Entry(self.root, width=50)
         self.db_path_entry.insert(0, self.db_path)
         self.db_path_entry.grid(row=0, column=1, padx=10, pady=2, sticky="ew")
@@ -140,8 +209,11 @@ class MainApp:
         button_frame = tk.Frame(self.root)
         button_frame.grid(row=3, column=0, pady=2)
 
-        script_button = tk.Button(button_frame, text="Update YAC with ComicInfo", command=self.run_CRtoYAC_conversion)
-        script_button.pack(expand=True, padx=10, pady=2)
+        self.script_button = tk.Button(button_frame, text="Update YAC with ComicInfo", command=self.run_CRtoYAC_conversion)
+        self.script_button.pack(side="left", expand=True, padx=10, pady=2)
+
+        self.cancel_button = tk.Button(button_frame, text="Cancel", command=self.cancel_conversion, state="disabled")
+        self.cancel_button.pack(side="left", expand=True, padx=10, pady=2)
 
         # Log tekstvak met scrollbars
         log_frame = tk.Frame(self.root)
@@ -166,30 +238,96 @@ class MainApp:
         self.progress_bar.grid(row=3, column=1, columnspan=3, padx=10, pady=2, sticky="ew")
 
     def run_CRtoYAC_conversion(self):
-        db_location = self.db_path_entry.get()
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        db_locations = split_paths(self.db_path_entry.get(), DB_PATH_SEPARATOR)
         xml_location = self.xml_path_entry.get()
 
+        # Als debug is ingeschakeld, zet het logniveau op DEBUG
+        if self.debug_var.get():
+            log_level = logging.DEBUG
+        else:
+            log_level = logging.INFO
+
+        # lees de Tk variabelen hier uit, ze mogen niet vanuit de worker thread gebruikt worden
         try:
-            # Als debug is ingeschakeld, zet het logniveau op DEBUG
-            if self.debug_var.get():
-                log_level = logging.DEBUG
-            else:
-                log_level = logging.INFO
+            from cr_multi import create_converter
+            self.setup_logging()
+            if not db_locations:
+                raise ValueError("no YAC database selected")
+            converter = create_converter(db_locations, xml_location, self.report_progress, self.queue_handler, self.overwrite_all.get(), log_level, self.verbose_var.get(), self.syncread_var.get(), cancel_event=self.cancel_event, **self.options)
+        except Exception as e:
+            from tkinter import messagebox
+            messagebox.showerror("Fout", f"There was an error: {e}")
+            return
 
-            # roep de data conversie van ComicInfoDB naar YAC aan
-            converter = CRConverter(db_location, xml_location, self.progress_bar, self.log_text, self.overwrite_all, log_level, self.verbose_var.get(), self.syncread_var.get())
-            converter.run()
+        self.cancel_event.clear()
+        self.worker_error = None
+        self.script_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+
+        # roep de data conversie van ComicInfoDB naar YAC aan in een aparte thread
+        self.worker = threading.Thread(target=self.run_converter, args=(converter,), daemon=True)
+        self.worker.start()
+        self.root.after(POLL_INTERVAL, self.poll_queue)
+
+    def report_progress(self, value, maximum):
+        # wordt aangeroepen vanuit de worker thread
+        self.queue.put((value, maximum))
 
+    def run_converter(self, converter):
+        # draait in de worker thread
+        try:
+            converter.run()
         except Exception as e:
-            messagebox.showerror("Fout", f"There was an error: {e}")
+            self.worker_error = e
+
+    def poll_queue(self):
+        # Verwerk de logregels en voortgang uit de queue in de Tk thread. De voortgang wordt per keer
+        # maar één keer bijgewerkt, met de laatste waarde.
+        progress = None
+        for _ in range(POLL_MAX_RECORDS):
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if isinstance(item, logging.LogRecord):
+                self.gui_handler.handle(item)
+            else:
+                progress = item
+        self.gui_handler.flush()
+
+        if progress is not None:
+            self.progress_bar['maximum'] = progress[1]
+            self.progress_bar['value'] = progress[0]
+
+        if self.worker.is_alive() or not self.queue.empty():
+            self.root.after(POLL_INTERVAL, self.poll_queue)
+        else:
+            self.conversion_finished()
+
+    def conversion_finished(self):
+        self.script_button.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
+        if self.worker_error is not None:
+            from tkinter import messagebox
+            messagebox.showerror("Fout", f"There was an error: {self.worker_error}")
+
+    def cancel_conversion(self):
+        self.cancel_event.set()
+        self.cancel_button.configure(state="disabled")
 
     def browse_db(self):
         # Open een bestandsdialoog voor het selecteren van de database en stel de initiële directory in op basis van de configuratie.
         # Verkrijg de opgeslagen database locatie uit de configuratie
-        _, _, saved_db_path, _, _, _, _, _ = self.read_config()
-        initial_dir = os.path.dirname(saved_db_path) if saved_db_path else ''
+        _, _, saved_db_path, _, _, _, _, _, _ = self.read_config()
+        saved_db_paths = split_paths(saved_db_path, DB_PATH_SEPARATOR)
+        initial_dir = os.path.dirname(saved_db_paths[0]) if saved_db_paths else ''
         
         # Open de dialoog en stel de initiële directory in
+        from tkinter import filedialog
         db_path = filedialog.askopenfilename(filetypes=[("SQLite DB", "*.ydb")], initialdir=initial_dir)
         if db_path:
             self.db_path_entry.delete(0, tk.END)
@@ -198,17 +336,24 @@ class MainApp:
     def browse_xml(self):
         # Open een bestandsdialoog voor het selecteren van de XML-bestand en stel de initiële directory in op basis van de configuratie.
         # Verkrijg de opgeslagen XML locatie uit de configuratie
-        _, _, _, saved_xml_path, _, _, _, _ = self.read_config()
+        _, _, _, saved_xml_path, _, _, _, _, _ = self.read_config()
         
         initial_dir = os.path.dirname(saved_xml_path) if saved_xml_path else ''
         
         # Open de dialoog en stel de initiële directory in
+        from tkinter import filedialog
         xml_path = filedialog.askopenfilename(filetypes=[("XML Files", "*.xml")], initialdir=initial_dir)
         if xml_path:
             self.xml_path_entry.delete(0, tk.END)
             self.xml_path_entry.insert(0, xml_path)
 
     def on_closing(self):
+        # breek een lopende conversie eerst af, zodat de database en XML netjes worden afgesloten
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.root.after(POLL_INTERVAL, self.on_closing)
+            return
+
         self.save_config()
         self.root.destroy()
 
@@ -216,7 +361,15 @@ def main():
     root = tk.Tk()
     app = MainApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
+    if os.environ.get(STARTUP_CHECK):
+        root.update()
+        root.destroy()
+        return
     root.mainloop()
 
 if __name__ == "__main__":
+    # alleen de bevroren versie heeft freeze_support nodig voor de worker processen
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     main()
@@ -0,0 +1,152 @@
+import argparse
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+
+from cr_converter import CRConverter
+from cr_multi import create_converter
+from cr_config import CONFIG_FILE, load_config, read_paths, read_flag, read_options
+from cr_plan import ChangePlan, PlanError
+
+# Exit codes van de command line versie
+EXIT_OK = 0
+EXIT_ERROR = 1          # database of XML bestand kon niet geopend worden
+EXIT_FAILED_UPDATES = 2 # de run is afgerond, maar niet alle updates konden worden weggeschreven
+EXIT_CANCELLED = 130    # afgebroken met Ctrl+C
+
+class ConsoleProgress:
+    # Toont de voortgang op stderr: op een terminal op één regel, anders per 10%
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self.last_percent = -1
+
+    def __call__(self, value, maximum):
+        percent = value * 100 // maximum if maximum else 100
+        if percent == self.last_percent:
+            return
+        if not self.interactive and percent % 10 != 0:
+            return
+        self.last_percent = percent
+
+        if self.interactive:
+            self.stream.write(f"\rProcessing comics: {percent:3d}% ({value}/{maximum})")
+            if value >= maximum:
+                self.stream.write("\n")
+        else:
+            self.stream.write(f"Processing comics: {percent:3d}% ({value}/{maximum})\n")
+        self.stream.flush()
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Update the YAC library with the information from the ComicRack ComicDB.xml.")
+    parser.add_argument('--db', dest='db_paths', action='append', help="location of a YAC library database (library.ydb); repeat to sync several libraries in one run")
+    parser.add_argument('--xml', dest='xml_path', help="location of the ComicRack ComicDB.xml")
+    parser.add_argument('--config', nargs='?', const=CONFIG_FILE, metavar='INI',
+                        help=f"read paths and options from the configuration file (default {CONFIG_FILE}); command line flags take precedence")
+    parser.add_argument('--force', action='store_true', help="force overwrite all data")
+    parser.add_argument('--sync-read', action='store_true', help="sync read status to ComicRack")
+    parser.add_argument('--verbose', action='store_true', help="show update queries")
+    parser.add_argument('--debug', action='store_true', help="show debug information")
+    parser.add_argument('--incremental', action='store_true', help="only process comics that changed since the previous run")
+    parser.add_argument('--resume', action='store_true', help="continue an interrupted run after the last committed comic")
+    parser.add_argument('--fast-scan', action='store_true', help="read ComicDB.xml with the fast scanner, falling back to ElementTree")
+    parser.add_argument('--xml-cache', action='store_true', help="reuse the parsed ComicDB.xml from the cache while the file does not change")
+    parser.add_argument('--dry-run', action='store_true', help="report the pending changes without writing to the YAC database or ComicDB.xml")
+    parser.add_argument('--plan', metavar='FILE', help="write the computed changes as JSON to FILE before applying them; combine with --dry-run for a preview")
+    parser.add_argument('--apply-plan', metavar='FILE', help="apply the changes from a plan written with --plan instead of comparing the libraries")
+    parser.add_argument('--plan-other-db', action='store_true', help="apply the plan to --db even if it was made for another YAC database")
+    parser.add_argument('--workers', type=int, help="number of processes used for matching the comics")
+    parser.add_argument('--no-progress', action='store_true', help="do not show progress")
+    parser.add_argument('--metrics', metavar='FILE', help="write timings and counters of the run as JSON to FILE")
+    parser.add_argument('--profile', metavar='FILE', help="profile the run with cProfile and write the statistics to FILE")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    db_paths, xml_path = args.db_paths or [], args.xml_path
+    verbose, syncread = args.verbose, args.sync_read
+    options = {}
+    if args.config:
+        config = load_config(args.config)
+        config_db_paths, config_xml_path = read_paths(config)
+        db_paths = db_paths or config_db_paths
+        xml_path = xml_path or config_xml_path
+        verbose = verbose or read_flag(config, 'show_query')
+        syncread = syncread or read_flag(config, 'sync_read')
+        options = read_options(config)
+
+    if args.incremental:
+        options['incremental'] = True
+    if args.resume:
+        options['resume'] = True
+    if args.fast_scan:
+        options['fast_scan'] = True
+    if args.xml_cache:
+        options['xml_cache'] = True
+    if args.dry_run:
+        options['dry_run'] = True
+    if args.workers is not None:
+        options['workers'] = args.workers
+    if args.plan:
+        options['plan_file'] = args.plan
+    if args.metrics:
+        options['metrics_file'] = args.metrics
+    if args.profile:
+        options['profile_file'] = args.profile
+
+    plan = None
+    if args.apply_plan:
+        try:
+            plan = ChangePlan.load(args.apply_plan)
+        except PlanError as e:
+            print(e, file=sys.stderr)
+            return EXIT_ERROR
+        db_paths = db_paths or [plan.db_location]
+        xml_path = xml_path or plan.xml_location
+        if len(db_paths) > 1:
+            print("A change plan belongs to one YAC database, --apply-plan accepts only one --db.", file=sys.stderr)
+            return EXIT_ERROR
+
+    if not db_paths or not xml_path:
+        print("Both the YAC database (--db) and ComicDB.xml (--xml) locations are required.", file=sys.stderr)
+        return EXIT_ERROR
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    progress = None if args.no_progress else ConsoleProgress()
+
+    # Ctrl+C breekt de conversie netjes af na de huidige comic
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+
+    converter = create_converter(db_paths, xml_path, progress, handler, args.force, log_level, verbose, syncread, cancel_event=cancel_event, **options)
+    try:
+        completed = converter.replay(plan, args.plan_other_db) if plan is not None else converter.run()
+    except Exception as e:
+        logging.getLogger(CRConverter.__module__).error(f"There was an error: {e}")
+        return EXIT_ERROR
+
+    # bij meerdere libraries een regel per verwerkte library
+    if len(db_paths) > 1:
+        summaries = converter.summary()
+    else:
+        summaries = {None: converter.summary()} if completed else {}
+    for library, summary in summaries.items():
+        counts = ", ".join(f"{name}: {count}" for name, count in summary.items())
+        print(f"{library}: {counts}" if library is not None else counts)
+
+    if not completed:
+        return EXIT_ERROR
+    if cancel_event.is_set():
+        return EXIT_CANCELLED
+    if any(summary['failed'] for summary in summaries.values()):
+        return EXIT_FAILED_UPDATES
+    return EXIT_OK
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
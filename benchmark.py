@@ -0,0 +1,245 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+from cr_comicdb import read_books, iter_books, scan_books, write_read_status
+from cr_converter import BookColumns, CRConverter, comic_updates, read_status_update
+from cr_plan import ChangePlan
+
+# Benchmark van CRConverter op synthetische data. Voor elke grootte wordt een ComicDB.xml en een
+# YAC library.ydb gegenereerd, waarna de fases van de conversie los van elkaar worden getimed.
+# Elke grootte draait in een eigen proces, zodat het piekgeheugen per grootte gemeten wordt.
+
+DEFAULT_SIZES = (1000, 10000, 100000, 500000)
+
+PUBLISHERS = ('Marvel', 'DC Comics', 'Image', 'Dark Horse', 'IDW Publishing', 'Dargaud', 'Le Lombard')
+HIDDEN_CHARACTERS = ('\u200b', '\u00a0', '\ufeff')
+
+def peak_memory():
+    # Piek van het geheugengebruik (RSS) van dit proces in MB, None als dat niet te bepalen is
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+def generate_library(directory, size, mismatch_ratio=0.05, hidden_ratio=0.02, read_ratio=0.3, seed=1):
+    # Genereer een ComicDB.xml met size boeken en een YAC library.ydb met een comic per boek.
+    # Een deel mismatch_ratio van de YAC paden heeft een extra map vooraan; die matcht alleen met
+    # fallback_matching, op de staart van het pad. Een deel hidden_ratio van de XML paden bevat
+    # onzichtbare tekens die bij het matchen wegvallen.
+    rng = random.Random(seed)
+    xml_location = os.path.join(directory, 'ComicDB.xml')
+    db_location = os.path.join(directory, 'library.ydb')
+
+    conn = sqlite3.connect(db_location)
+    conn.execute("CREATE TABLE comic_info (id INTEGER PRIMARY KEY, title TEXT, coverPage INTEGER DEFAULT 1, numPages INTEGER, number TEXT, isBis BOOLEAN, count INTEGER, volume TEXT, storyArc TEXT, arcNumber TEXT, arcCount INTEGER, genere TEXT, writer TEXT, penciller TEXT, inker TEXT, colorist TEXT, letterer TEXT, coverArtist TEXT, date TEXT, publisher TEXT, format TEXT, color BOOLEAN, ageRating TEXT, synopsis TEXT, characters TEXT, notes TEXT, hash TEXT UNIQUE NOT NULL, edited BOOLEAN DEFAULT 0, read BOOLEAN DEFAULT 0, hasBeenOpened BOOLEAN DEFAULT 0, rating INTEGER DEFAULT 0, currentPage INTEGER DEFAULT 1, bookmark1 INTEGER DEFAULT -1, bookmark2 INTEGER DEFAULT -1, bookmark3 INTEGER DEFAULT -1, brightness INTEGER DEFAULT -1, contrast INTEGER DEFAULT -1, gamma INTEGER DEFAULT -1, comicVineID TEXT, series TEXT, imprint TEXT)")
+    conn.execute("CREATE TABLE comic (id INTEGER PRIMARY KEY, parentId INTEGER NOT NULL, comicInfoId INTEGER NOT NULL, fileName TEXT NOT NULL, path TEXT)")
+
+    comic_info = []
+    comics = []
+    with open(xml_location, 'w', encoding='utf-8') as xml_file:
+        xml_file.write('<?xml version="1.0"?>\n<ComicDatabase xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n  <Books>\n')
+
+        for comic_id in range(1, size + 1):
+            publisher = rng.choice(PUBLISHERS)
+            series = f"Series {rng.randrange(max(1, size // 20))}"
+            number = rng.randrange(1, 200)
+            page_count = rng.randrange(20, 60)
+            file_size = rng.randrange(5_000_000, 80_000_000)
+            file_name = f"{series} #{number:03d} ({comic_id}).cbz"
+            yac_path = f"/{publisher}/{series}/{file_name}"
+            xml_path = f"D:\\Comics\\{publisher}\\{series}\\{file_name}"
+
+            if rng.random() < hidden_ratio:
+                xml_path = xml_path.replace(' #', rng.choice(HIDDEN_CHARACTERS) + ' #', 1)
+            if rng.random() < mismatch_ratio:
+                yac_path = '/Library' + yac_path
+
+            comic_info.append((comic_id, f"{'%040x' % rng.getrandbits(160)}{file_size}", 1 if rng.random() < read_ratio / 2 else 0))
+            comics.append((comic_id, 1, comic_id, file_name, yac_path))
+
+            fields = [
+                ('Series', series), ('Number', str(number)), ('Volume', str(rng.randrange(1, 5))),
+                ('Title', f"Title {comic_id} & more"), ('Writer', f"Writer {rng.randrange(500)}"),
+                ('Penciller', f"Artist {rng.randrange(500)}"), ('Publisher', publisher),
+                ('Year', str(rng.randrange(1950, 2025))), ('Month', str(rng.randrange(1, 13))),
+                ('PageCount', str(page_count)), ('FileSize', str(file_size)),
+            ]
+            if rng.random() < read_ratio:
+                fields.append(('LastPageRead', str(page_count - 1 if rng.random() < 0.7 else rng.randrange(page_count))))
+
+            xml_file.write(f'    <Book Id="{comic_id:08d}-0000-0000-0000-000000000000" File={quoteattr(xml_path)}>\n')
+            for tag, value in fields:
+                xml_file.write(f'      <{tag}>{escape(value)}</{tag}>\n')
+            xml_file.write('    </Book>\n')
+
+        xml_file.write('  </Books>\n</ComicDatabase>\n')
+
+    conn.executemany("INSERT INTO comic_info (id, hash, read) VALUES (?, ?, ?)", comic_info)
+    conn.executemany("INSERT INTO comic (id, parentId, comicInfoId, fileName, path) VALUES (?, ?, ?, ?, ?)", comics)
+    conn.commit()
+    conn.close()
+    return db_location, xml_location
+
+class Timer:
+    def __init__(self):
+        self.phases = {}
+
+    def phase(self, name):
+        timer = self
+
+        class Phase:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                timer.phases[name] = round(time.perf_counter() - self.start, 4)
+
+        return Phase()
+
+def run_size(size, options):
+    # Draait in een eigen proces: genereer de data en time de fases van de conversie
+    directory = tempfile.mkdtemp(prefix=f'cr_benchmark_{size}_', dir=options['workdir'])
+    try:
+        start = time.perf_counter()
+        db_location, xml_location = generate_library(directory, size, options['mismatch'], options['hidden'], options['read'], options['seed'])
+        generate_time = time.perf_counter() - start
+
+        converter = CRConverter(db_location, xml_location, log_level=logging.ERROR, syncread=True, batch_size=options['batch_size'], fallback_matching=options['fallback_matching'])
+        timer = Timer()
+        wall = time.perf_counter()
+
+        with timer.phase('parse'):
+            if options['fast_scan']:
+                books = scan_books(xml_location)
+            elif options['streaming']:
+                books = list(iter_books(xml_location))
+            else:
+                _, books = read_books(xml_location, keep_element=False)
+
+        with timer.phase('index'):
+            converter.build_index(books)
+
+        with timer.phase('connect'):
+            converter.connect_to_db()
+
+        with timer.phase('preload'):
+            converter.comic_table, _ = converter.load_comics()
+        comics = converter.comic_table.comics
+
+        # dezelfde zoektocht als de converter, met de grootte, serie, nummer, volume en jaar uit comic_info
+        with timer.phase('match'):
+            matches = [(comic_id, path) + converter.match_book(comic_id, path)[:2] for comic_id, path in comics]
+        strategies = collections.Counter(strategy for _, _, book, strategy in matches if book is not None)
+        matches = [(comic_id, path, book) for comic_id, path, book, _ in matches if book is not None]
+
+        with timer.phase('diff'):
+            table = converter.comic_table
+            columns = BookColumns(converter.LOOKUP_TABLE, converter.book_index.books)
+            updates = []
+            for comic_id, path, book in matches:
+                fields_to_update, update_values = comic_updates(columns, columns.row(book), table.row(comic_id), False)
+                last_page_read = read_status_update(book, table.value(comic_id, 'Read'))
+                updates.append((comic_id, path, book, fields_to_update, update_values, last_page_read))
+
+        with timer.phase('write'):
+            plan = ChangePlan(db_location, xml_location)
+            for comic_id, path, book, fields_to_update, update_values, last_page_read in updates:
+                if fields_to_update:
+                    plan.add_yac_update(comic_id, path, fields_to_update, update_values)
+            converter.apply_plan(plan)
+
+        read_status = {book.position: (book.File, last_page_read) for _, _, book, _, _, last_page_read in updates if last_page_read is not None}
+        with timer.phase('xml_write'):
+            if read_status:
+                write_read_status(xml_location, read_status)
+
+        wall = time.perf_counter() - wall
+        converter.close_db()
+
+        return {
+            'size': size,
+            'comics': len(comics),
+            'matched': len(matches),
+            'strategies': dict(strategies),
+            'updated': converter.writer.written,
+            'read_status_changes': len(read_status),
+            'xml_mb': round(os.path.getsize(xml_location) / (1024 * 1024), 1),
+            'generate_seconds': round(generate_time, 2),
+            'wall_seconds': round(wall, 4),
+            'phases': timer.phases,
+            'rows_per_second': round(len(comics) / wall) if wall else None,
+            'peak_rss_mb': peak_memory(),
+        }
+    finally:
+        if not options['keep']:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ComicRack to YAC conversion on synthetic libraries.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="number of books per run (default: %(default)s)")
+    parser.add_argument('--mismatch', type=float, default=0.05, help="fraction of YAC paths with an extra folder in front, only matched with --fallback-matching (default: %(default)s)")
+    parser.add_argument('--hidden', type=float, default=0.02, help="fraction of ComicRack paths with hidden characters (default: %(default)s)")
+    parser.add_argument('--read', type=float, default=0.3, help="fraction of read comics (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--streaming', action='store_true', help="parse ComicDB.xml with the streaming parser")
+    parser.add_argument('--fast-scan', action='store_true', help="parse ComicDB.xml with the fast scanner")
+    parser.add_argument('--fallback-matching', action='store_true', help="also match comics without an equal path, as with fallback_matching")
+    parser.add_argument('--workdir', default=None, help="directory for the generated files (default: system temp)")
+    parser.add_argument('--keep', action='store_true', help="keep the generated files")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file with the results (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    options = {
+        'mismatch': args.mismatch, 'hidden': args.hidden, 'read': args.read, 'seed': args.seed,
+        'batch_size': args.batch_size, 'streaming': args.streaming, 'fast_scan': args.fast_scan, 'fallback_matching': args.fallback_matching, 'workdir': args.workdir, 'keep': args.keep,
+    }
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_size, size, options).result()
+        results.append(result)
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in result['phases'].items())
+        print(f"{size:>7} books: {result['wall_seconds']:.2f}s, {result['rows_per_second']} comics/s, peak {result['peak_rss_mb']} MB ({phases})")
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {name: value for name, value in options.items() if name not in ('workdir', 'keep')},
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
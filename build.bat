@@ -1,2 +1,3 @@
 python buildsetup.py
-pyinstaller --onefile --windowed ComicDBConverter.py
\ No newline at end of file
+pyinstaller --onefile --windowed ComicDBConverter.py
+pyinstaller --onefile ComicDBConverterCLI.py
\ No newline at end of file
@@ -0,0 +1,43 @@
+import hashlib
+import marshal
+import os
+
+from cr_comicdb import write_atomic
+# CACHE_FILE: standaard bestand met de ingelezen gegevens uit ComicDB.xml
+from cr_config import CACHE_FILE
+
+# Verhoog bij een wijziging in de opbouw van de cache, zodat oude bestanden genegeerd worden
+CACHE_VERSION = 2
+
+# Aantal bytes aan het begin en einde van ComicDB.xml dat meetelt in de controle
+HASH_BLOCK = 65536
+
+def xml_signature(xml_location):
+    # Goedkope controle of ComicDB.xml veranderd is: pad, grootte, wijzigingstijd en een hash van
+    # het begin en einde van het bestand
+    stat = os.stat(xml_location)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(xml_location, 'rb') as xml_file:
+        digest.update(xml_file.read(HASH_BLOCK))
+        if stat.st_size > HASH_BLOCK:
+            xml_file.seek(max(HASH_BLOCK, stat.st_size - HASH_BLOCK))
+            digest.update(xml_file.read())
+    return (os.path.abspath(xml_location), stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+def load_cache(cache_file, xml_location, settings):
+    # Levert de opgeslagen gegevens als de cache bij deze versie van ComicDB.xml en deze instellingen
+    # hoort, anders None. settings moet uit waarden bestaan die marshal kan opslaan.
+    # De kop met versie, instellingen en controle staat los van de gegevens, zodat een verouderde
+    # cache herkend wordt zonder de gegevens in te lezen
+    try:
+        with open(cache_file, 'rb') as cache:
+            version, cached_settings, signature = marshal.load(cache)
+            if version != CACHE_VERSION or cached_settings != settings or signature != xml_signature(xml_location):
+                return None
+            return marshal.loads(cache.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+def save_cache(cache_file, xml_location, settings, payload):
+    header = marshal.dumps((CACHE_VERSION, settings, xml_signature(xml_location)))
+    write_atomic(cache_file, header + marshal.dumps(payload))
@@ -0,0 +1,404 @@
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+# Velden uit een <Book> in ComicDB.xml die de converter gebruikt: de velden uit de LOOKUP_TABLE
+# plus de velden waaruit de datum en de gelezen status worden afgeleid, en de bestandsgrootte
+# voor het matchen op bestandsnaam en grootte.
+BOOK_FIELDS = (
+    'Title', 'Series', 'Volume', 'Number', 'Writer', 'Penciller', 'Inker', 'Publisher', 'Imprint',
+    'CurrentPage', 'Year', 'Month', 'Day', 'LastPageRead', 'PageCount', 'FileSize',
+)
+
+# Volgorde van de waarden in BookRecord.to_tuple
+TUPLE_FIELDS = ('File', 'position') + BOOK_FIELDS
+
+class BookRecord:
+    # Compacte weergave van een <Book> uit ComicDB.xml met alleen de velden uit BOOK_FIELDS.
+    # Een veld dat niet in het boek voorkomt is None, net als de tekst van een leeg element.
+    # position is het volgnummer van het boek binnen <Books>. Bij het inlezen via de DOM verwijst
+    # element naar het oorspronkelijke <Book> element, bij scan_books is offset de positie van het
+    # <Book> element in de bytes van het bestand.
+    __slots__ = ('File', 'position', 'element', 'offset') + BOOK_FIELDS
+
+    def __init__(self, file_name, position, element=None):
+        self.File = file_name
+        self.position = position
+        self.element = element
+        self.offset = None
+        for field in BOOK_FIELDS:
+            setattr(self, field, None)
+
+    @classmethod
+    def from_element(cls, element, position, keep_element=True):
+        record = cls(element.get('File'), position, element if keep_element else None)
+        for child in element:
+            if child.tag in BOOK_FIELDS:
+                setattr(record, child.tag, child.text)
+        return record
+
+    def text(self, field):
+        return getattr(self, field)
+
+    def to_tuple(self):
+        # Compacte vorm zonder element, om door te geven aan andere processen of op te slaan
+        return (self.File, self.position) + tuple(getattr(self, field) for field in BOOK_FIELDS)
+
+    @classmethod
+    def from_tuple(cls, values):
+        record = cls.__new__(cls)
+        record.element = None
+        record.offset = None
+        for field, value in zip(TUPLE_FIELDS, values):
+            setattr(record, field, value)
+        return record
+
+def read_books(xml_location, keep_element=True):
+    # Lees ComicDB.xml volledig in als DOM; levert de tree en de boeken als BookRecord. Zonder
+    # keep_element verwijzen de boeken niet naar de DOM, die dan opgeruimd kan worden.
+    tree = ET.parse(xml_location)
+    books = tree.getroot().find('Books')
+    books = books.findall('Book') if books is not None else []
+    return tree, [BookRecord.from_element(book, position, keep_element) for position, book in enumerate(books)]
+
+def iter_books(xml_location):
+    # Lees ComicDB.xml stapsgewijs in met iterparse. Van elk <Book> worden alleen de velden uit
+    # BOOK_FIELDS bewaard, waarna het element direct wordt opgeruimd. Het geheugengebruik hangt
+    # daardoor af van het aantal boeken en niet van de grootte van het XML bestand.
+    depth = 0
+    parent = None
+    record = None
+    position = 0
+
+    for event, element in ET.iterparse(xml_location, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                parent = element
+            elif depth == 3 and element.tag == 'Book' and parent.tag == 'Books':
+                record = BookRecord(element.get('File'), position)
+                position += 1
+            continue
+
+        depth -= 1
+        if record is None:
+            continue
+
+        if depth == 3:
+            if element.tag in BOOK_FIELDS:
+                setattr(record, element.tag, element.text)
+        elif depth == 2:
+            yield record
+            record = None
+            element.clear()
+            parent.clear()
+
+# Start- of eindtag van een element; groepen: '/' bij een eindtag, naam, attributen en '/' bij een leeg element
+ELEMENT_TAG = re.compile(rb'''<(/?)([A-Za-z_][\w:.-]*)((?:\s+[\w:.-]+\s*=\s*(?:"[^"]*"|'[^']*'))*)\s*(/?)>''')
+BOOK_START = re.compile(rb'<Book[\s/>]')
+DEFAULT_NAMESPACE = re.compile(rb'\sxmlns\s*=')
+LAST_PAGE_READ = re.compile(rb'<LastPageRead\s*/>|<LastPageRead>[^<]*</LastPageRead>')
+XML_ENCODING = re.compile(rb'<\?xml[^>]*encoding=["\']([A-Za-z0-9._-]+)["\']')
+# Byte order marks van UTF-16 en UTF-32; met of zonder encoding declaratie past geen van de byte zoekacties
+WIDE_BOMS = (b'\x00\x00\xfe\xff', b'\xff\xfe', b'\xfe\xff')
+
+class PatchError(Exception):
+    # ComicDB.xml bevat iets wat de patch writer niet veilig kan aanpassen
+    pass
+
+def check_encoding(data):
+    # De byte zoekacties werken alleen voor UTF-8 en ASCII
+    start = data[:4]
+    if start.startswith(WIDE_BOMS) or b'\x00' in start:
+        raise PatchError("unsupported encoding UTF-16 or UTF-32")
+    encoding = XML_ENCODING.search(data[:200])
+    if encoding is not None and encoding.group(1).lower() not in (b'utf-8', b'utf8', b'us-ascii', b'ascii'):
+        raise PatchError(f"unsupported encoding {encoding.group(1).decode('ascii')}")
+
+def iter_book_spans(data):
+    # Levert (start, einde) van elk <Book> element in de bytes van ComicDB.xml, in documentvolgorde.
+    # Net als bij read_books tellen alleen de <Book> elementen direct onder de eerste <Books> die
+    # een direct kind is van het root element; een <Books> elders in het bestand telt niet mee.
+    depth = 0
+    in_books = False
+    position = data.find(b'<')
+    while position != -1:
+        markup = data[position:position + 2]
+        if markup == b'<?':
+            end = data.find(b'?>', position)
+            if end == -1:
+                raise PatchError("unterminated processing instruction")
+            position = data.find(b'<', end + 2)
+            continue
+        if markup == b'<!':
+            raise PatchError(f"unsupported markup at byte {position}")
+
+        tag = ELEMENT_TAG.match(data, position)
+        if tag is None:
+            raise PatchError(f"unexpected markup at byte {position}")
+        closing, name, attributes, empty = tag.groups()
+        if closing:
+            depth -= 1
+            if depth == 0 or (in_books and depth == 1):
+                return
+        elif in_books and depth == 2 and name == b'Book':
+            if empty:
+                end = tag.end()
+            else:
+                end = data.find(b'</Book>', tag.end())
+                if end == -1:
+                    raise PatchError("unterminated <Book> element")
+                if BOOK_START.search(data, tag.end(), end) is not None:
+                    raise PatchError("nested <Book> element")
+                end += len(b'</Book>')
+            yield position, end
+            position = data.find(b'<', end)
+            continue
+        else:
+            if depth == 0 and DEFAULT_NAMESPACE.search(attributes):
+                # ElementTree vindt de boeken dan niet onder de naam Books
+                raise PatchError("default namespace on the root element")
+            if depth == 1 and name == b'Books':
+                if empty:
+                    return
+                in_books = True
+            if not empty:
+                depth += 1
+        position = data.find(b'<', tag.end())
+
+    if not in_books:
+        raise PatchError("no <Books> element under the root element")
+
+class ScanError(Exception):
+    # ComicDB.xml bevat iets wat scan_books niet begrijpt, gebruik ElementTree
+    pass
+
+# Een element zonder attributen en kinderen, of anders een losse tag, met de tekst die erop volgt.
+# Groepen: naam en tekst van het eenvoudige element, of '/' bij een eindtag, naam, attributen en
+# '/' bij een leeg element; als laatste de tekst tot de volgende '<'.
+TOKEN = re.compile(r'''<(?:([A-Za-z_][\w:.-]*)>([^<]*)</\1\s*>|(/?)([A-Za-z_][\w:.-]*)((?:\s+[\w:.-]+\s*=\s*(?:"[^"<]*"|'[^'<]*'))*)\s*(/?)>)([^<]*)''')
+ATTRIBUTE = re.compile(r'''\s([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+ENTITY = re.compile(r'&(?:(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);)?')
+ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+FIELD_NAMES = frozenset(BOOK_FIELDS)
+
+def replace_entity(match):
+    name = match.group(1)
+    if name is None:
+        raise ScanError("unknown entity")
+    if name.startswith('#x'):
+        return chr(int(name[2:], 16))
+    if name.startswith('#'):
+        return chr(int(name[1:]))
+    return ENTITIES[name]
+
+def unescape(text):
+    return ENTITY.sub(replace_entity, text) if '&' in text else text or None
+
+def book_file(attributes, offset):
+    # Het File attribuut uit de attributen van een <Book> start tag, zoals een XML parser het levert
+    file_name = None
+    for attribute in ATTRIBUTE.finditer(attributes):
+        if attribute.group(1) == 'File':
+            value = attribute.group(2) if attribute.group(2) is not None else attribute.group(3)
+            if '<' in value:
+                raise ScanError(f"'<' in attribute value at byte {offset}")
+            # in attributen worden witruimtetekens een spatie
+            file_name = unescape(value.replace('\t', ' ').replace('\n', ' '))
+    return file_name
+
+def scan_book(span, offset, position):
+    # Lees de velden uit BOOK_FIELDS uit de bytes van één <Book> element. Alleen de directe kinderen
+    # van <Book> tellen, net als bij BookRecord.from_element. Regeleinden worden '\n', zoals een
+    # XML parser dat doet.
+    try:
+        span = span.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ScanError(e)
+    if '\r' in span:
+        span = span.replace('\r\n', '\n').replace('\r', '\n')
+
+    # elke '<' moet bij een herkende tag horen, een eenvoudig element bevat er twee
+    tokens = TOKEN.findall(span)
+    markup = span.count('<') - len(tokens)
+    if not tokens or tokens[0][3] != 'Book':
+        raise ScanError(f"unexpected markup in <Book> at byte {offset}")
+
+    record = BookRecord(book_file(tokens[0][4], offset), position)
+    record.offset = offset
+    if tokens[0][5]:
+        if markup:
+            raise ScanError(f"unexpected markup in <Book> at byte {offset}")
+        return record
+
+    open_tags = []
+    for leaf, leaf_text, closing, name, _, empty, text in tokens[1:-1]:
+        if leaf:
+            markup -= 1
+            if not open_tags and leaf in FIELD_NAMES:
+                setattr(record, leaf, unescape(leaf_text) if '&' in leaf_text else leaf_text or None)
+        elif closing:
+            if not open_tags or open_tags.pop() != name:
+                raise ScanError(f"mismatched end tag in <Book> at byte {offset}")
+        else:
+            if not open_tags and name in FIELD_NAMES:
+                # de tekst na de starttag, tot het eerste kind
+                setattr(record, name, None if empty else unescape(text))
+            if not empty:
+                open_tags.append(name)
+
+    if markup:
+        raise ScanError(f"unexpected markup in <Book> at byte {offset}")
+    if open_tags:
+        raise ScanError(f"unterminated element in <Book> at byte {offset}")
+    return record
+
+def scan_books(xml_location):
+    # Snelle lezer voor ComicDB.xml: het bestand wordt in het geheugen gemapt en de <Book> elementen
+    # worden met byte zoekacties gevonden, zoals bij het bijwerken van LastPageRead. Van elk boek
+    # worden alleen de velden uit BOOK_FIELDS gedecodeerd. Geeft ScanError bij XML die de scanner
+    # niet kent (UTF-16 of een andere encoding, DTD, commentaar, CDATA, geen <Books> onder het root
+    # element, geen boeken), gebruik dan read_books of iter_books.
+    with open(xml_location, 'rb') as xml_file:
+        try:
+            data = mmap.mmap(xml_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            raise ScanError(e)
+
+    try:
+        for markup in (b'<!DOCTYPE', b'<!--', b'<![CDATA['):
+            if data.find(markup) != -1:
+                raise ScanError(f"unsupported markup {markup.decode('ascii')}")
+
+        try:
+            check_encoding(data)
+            books = [scan_book(data[start:end], start, position) for position, (start, end) in enumerate(iter_book_spans(data))]
+        except PatchError as e:
+            raise ScanError(e)
+        # zonder boeken beslist ElementTree of het bestand echt geen boeken bevat
+        if not books:
+            raise ScanError("no books found")
+        return books
+    finally:
+        data.close()
+
+def patch_book(span, value):
+    # Zet LastPageRead in de bytes van één <Book> element
+    value = value.encode('ascii')
+    match = LAST_PAGE_READ.search(span)
+    if match is not None:
+        return span[:match.start()] + b'<LastPageRead>' + value + b'</LastPageRead>' + span[match.end():]
+
+    if span.endswith(b'/>'):
+        # <Book ... /> zonder velden
+        return span[:-2].rstrip() + b'><LastPageRead>' + value + b'</LastPageRead></Book>'
+
+    # voeg het veld toe na het laatste veld, met dezelfde inspringing als dat veld
+    close = len(span) - len(b'</Book>')
+    body_end = len(span[:close].rstrip())
+    line_start = span.rfind(b'\n', 0, body_end)
+    if line_start > 0 and span[line_start - 1:line_start] == b'\r':
+        # Windows regeleinden: neem de \r mee in de nieuwe regel
+        line_start -= 1
+    indent = b''
+    if line_start != -1:
+        line = span[line_start:body_end]
+        indent = line[:len(line) - len(line.lstrip())]
+    return span[:body_end] + indent + b'<LastPageRead>' + value + b'</LastPageRead>' + span[body_end:]
+
+def patch_read_status(data, read_status):
+    # Past alleen de gewijzigde <Book> elementen aan; de rest van het bestand blijft byte voor byte gelijk.
+    # read_status bevat per positie (File, LastPageRead); staat op een positie een ander bestand,
+    # dan wordt niets aangepast.
+    check_encoding(data)
+    if b'<!--' in data or b'<![CDATA[' in data:
+        raise PatchError("comments or CDATA sections")
+
+    remaining = len(read_status)
+    chunks = []
+    last = 0
+    for position, (start, end) in enumerate(iter_book_spans(data)):
+        if position in read_status:
+            file_name, last_page_read = read_status[position]
+            try:
+                found = book_file(ELEMENT_TAG.match(data, start).group(3).decode('utf-8'), start)
+            except (ScanError, UnicodeDecodeError) as e:
+                raise PatchError(e)
+            if found != file_name:
+                raise PatchError(f"book {position} in ComicDB.xml is {found}, not {file_name}")
+            chunks.append(data[last:start])
+            chunks.append(patch_book(data[start:end], last_page_read))
+            last = end
+            remaining -= 1
+            if not remaining:
+                break
+    if remaining:
+        raise PatchError(f"{remaining} books not found")
+    chunks.append(data[last:])
+    return b''.join(chunks)
+
+def current_umask():
+    # os.umask kan alleen gelezen worden door hem te zetten
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+def write_atomic(xml_location, data):
+    # Schrijf naar een tijdelijk bestand in dezelfde map en vervang daarna het origineel in één keer
+    directory = os.path.dirname(os.path.abspath(xml_location))
+    handle, temp_location = tempfile.mkstemp(prefix='.ComicDB.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        # mkstemp maakt het bestand alleen leesbaar voor de eigenaar: neem de rechten van het origineel
+        # over, of geef een nieuw bestand de gewone rechten volgens de umask
+        if os.path.exists(xml_location):
+            shutil.copymode(xml_location, temp_location)
+        else:
+            os.chmod(temp_location, 0o666 & ~current_umask())
+        os.replace(temp_location, xml_location)
+    except BaseException:
+        if os.path.exists(temp_location):
+            os.remove(temp_location)
+        raise
+
+def write_read_status(xml_location, read_status):
+    # Schrijf de aangepaste LastPageRead waarden in één keer weg in ComicDB.xml; read_status bevat
+    # per positie van het boek (File, LastPageRead), een boek met een ander bestand wordt niet
+    # aangepast. Levert False als de patch writer terug moest vallen op de volledige DOM.
+    with open(xml_location, 'rb') as xml_file:
+        data = xml_file.read()
+
+    try:
+        write_atomic(xml_location, patch_read_status(data, read_status))
+        return True
+    except PatchError:
+        pass
+
+    tree = ET.ElementTree(ET.fromstring(data))
+    books = tree.getroot().find('Books')
+    changed = False
+    for position, book in enumerate(books.findall('Book') if books is not None else []):
+        if position in read_status and book.get('File') == read_status[position][0]:
+            set_last_page_read(book, read_status[position][1])
+            changed = True
+    if not changed:
+        return False
+
+    output = io.BytesIO()
+    tree.write(output, encoding='utf-8', xml_declaration=True)
+    write_atomic(xml_location, output.getvalue())
+    return False
+
+def set_last_page_read(book, value):
+    # Zet LastPageRead van een <Book> element, voeg het veld toe als het niet bestaat
+    last_page_read = book.find('LastPageRead')
+    if last_page_read is None:
+        last_page_read = ET.SubElement(book, 'LastPageRead')
+    last_page_read.text = value
@@ -0,0 +1,81 @@
+import configparser
+import os
+
+# Configureer het pad naar je configuratiebestand
+CONFIG_FILE = 'ComicDBConverter.ini'
+
+# Standaard bestanden naast het configuratiebestand: de staat van de vorige run (cr_state) en de
+# ingelezen gegevens uit ComicDB.xml (cr_cache). Ze staan hier zodat de GUI bij het opstarten de
+# modules van de converter nog niet hoeft te importeren.
+STATE_FILE = 'ComicDBConverter.state'
+CACHE_FILE = 'ComicDBConverter.cache'
+
+# Opties voor de conversie die alleen via het configuratiebestand in te stellen zijn, met hun standaardwaarde.
+# De namen komen overeen met de parameters van CRConverter.
+CONVERTER_OPTIONS = {
+    'batch_size': 500,          # aantal updates per transactie, 0 betekent alles in één transactie
+    'preload_chunk_size': 0,    # aantal comics dat per keer uit de database gelezen wordt, 0 betekent alles
+    'streaming': False,         # lees ComicDB.xml stapsgewijs in, voor zeer grote bestanden
+    'fast_scan': False,         # lees ComicDB.xml met de snelle scanner, met ElementTree als terugval
+    'incremental': False,       # verwerk alleen comics die sinds de vorige run veranderd zijn
+    'state_file': STATE_FILE,   # bestand waarin de staat van de vorige run wordt bewaard
+    'resume': False,            # ga verder na het checkpoint van een afgebroken run
+    'workers': 0,               # aantal processen voor het matchen, 0 of 1 betekent in het hoofdproces
+    'xml_cache': False,         # bewaar de ingelezen ComicDB.xml tot het bestand verandert
+    'cache_file': CACHE_FILE,   # bestand voor de ingelezen ComicDB.xml
+    'fallback_matching': False, # zoek comics zonder gelijk pad op staart van het pad, naam en grootte, serie en nummer
+    'journal_mode': 'wal',      # journal mode tijdens de run (wal, delete, ...), leeg laat de database ongemoeid
+    'cache_size_mb': 64,        # page cache van de verbinding met de YAC database in MB
+    'mmap_size_mb': 256,        # deel van de YAC database dat in het geheugen gemapt wordt in MB, 0 is uit
+    'temp_store_memory': True,  # tijdelijke tabellen en indexen van SQLite in het geheugen
+    'busy_timeout': 5000,       # aantal ms wachten als YACReader de database vergrendeld heeft
+    'busy_retries': 3,          # aantal keer dat een batch daarna opnieuw geprobeerd wordt
+}
+
+def expand_path(path):
+    # Vervang eventuele %AppData% en andere environment variabelen in een pad.
+    return os.path.expandvars(path)
+
+def compress_path(path):
+    # Vervang delen van het pad met bekende omgevingsvariabelen, zoals %AppData%.
+    appdata_path = os.environ.get('APPDATA')
+    if appdata_path and path.startswith(appdata_path):
+        return path.replace(appdata_path, '%AppData%')
+    return path
+
+def load_config(config_file=CONFIG_FILE):
+    config = configparser.RawConfigParser()
+    config.read(config_file)
+    return config
+
+def split_paths(value, separator='\n'):
+    # Een lijst paden, zoals meerdere YAC databases in db_path, één per regel
+    return [path.strip() for path in value.split(separator) if path.strip()]
+
+def read_paths(config):
+    # Levert de lijst met YAC databases en het pad naar ComicDB.xml. db_path mag meerdere
+    # databases bevatten, één per ingesprongen vervolgregel.
+    db_paths = [expand_path(path) for path in split_paths(config.get('Paths', 'db_path', fallback=''))]
+    xml_path = expand_path(config.get('Paths', 'xml_path', fallback=''))
+    return db_paths, xml_path
+
+def read_flag(config, option):
+    try:
+        return config.getboolean('Options', option, fallback=False)
+    except Exception as e:
+        return False
+
+def read_options(config):
+    # Lees de opties uit CONVERTER_OPTIONS, met het type van de standaardwaarde
+    options = {}
+    for option, default in CONVERTER_OPTIONS.items():
+        try:
+            if isinstance(default, bool):
+                options[option] = config.getboolean('Options', option, fallback=default)
+            elif isinstance(default, int):
+                options[option] = config.getint('Options', option, fallback=default)
+            else:
+                options[option] = config.get('Options', option, fallback=default)
+        except Exception as e:
+            options[option] = default
+    return options
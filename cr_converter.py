@@ -1,8 +1,15 @@
 import sqlite3
 import os
+import re
+import time
 import xml.etree.ElementTree as ET
 import logging
-import tkinter as tk  # Zorg ervoor dat tk wordt geïmporteerd
+from cr_comicdb import BOOK_FIELDS, BookRecord, ScanError, read_books, iter_books, scan_books, write_read_status
+from cr_state import STATE_FILE, Checkpoint, SyncState, fingerprint
+from cr_metrics import Metrics, NullMetrics
+from cr_cache import CACHE_FILE, load_cache, save_cache
+from cr_plan import ChangePlan
+from cr_database import ConnectionProfile, is_busy, missing_indexes
 
 UPDATE_ALTIJD = 'UPDATE_ALTIJD'
 UPDATE_INDIEN_LEEG = 'UPDATE_INDIEN_LEEG'
@@ -14,6 +21,10 @@ def normalize_path(path):
 def remove_hidden_characters(text):
     return text.encode('ascii', 'ignore').decode('ascii')
 
+def path_key(path):
+    # Sleutel waarop paden van YAC en ComicRack met elkaar vergeleken worden.
+    return remove_hidden_characters(normalize_path(path))
+
 def combine_query_and_values(query, values):
     # Vervangt de vraagtekens in de SQL-query door de corresponderende waarden uit de values-lijst.
     for value in values:
@@ -29,26 +40,455 @@ def combine_query_and_values(query, values):
         query = query.replace('?', value, 1)
     return query
 
-class GUIHandler(logging.Handler):
-    def __init__(self, text_widget):
-        super().__init__()
-        self.text_widget = text_widget
-
-        self.text_widget.configure(state='disabled')
-        self.text_widget.tag_config('DEBUG', foreground='blue')
-        self.text_widget.tag_config('INFO', foreground='green')
-        self.text_widget.tag_config('WARNING', foreground='orange')
-        self.text_widget.tag_config('ERROR', foreground='red')
-        self.text_widget.tag_config('CRITICAL', foreground='magenta')
-        self.text_widget.tag_config('BOLD', font=('Helvetica', 10, 'bold'))
-
-    def emit(self, record):
-        msg = self.format(record)
-        self.text_widget.configure(state='normal')
-        tag = record.levelname
-        self.text_widget.insert(tk.END, msg + '\n', (tag, 'BOLD'))
-        self.text_widget.configure(state='disabled')
-        self.text_widget.yview(tk.END)
+def construct_date(book):
+    # Construeert een datumstring uit de jaar-, maand- en dagvelden.
+    # Begin met een lege datumstring
+    date_str = None
+
+    year = book.text('Year')
+    if year is not None:
+        date_str = year
+        month = book.text('Month')
+        if month is not None:
+            date_str = f"{month}-{date_str}"
+            day = book.text('Day')
+            if day:
+                date_str = f"{day}-{date_str}"
+
+    return date_str
+
+# comic_info kolommen die YAC als getal opslaat; de overige gemapte kolommen zijn tekst
+INTEGER_COLUMNS = frozenset(('currentpage', 'read'))
+
+def coerce_value(value, integer):
+    # Zet een waarde uit ComicDB.xml of YAC om naar het type van de YAC kolom, zodat '3' en 3
+    # gelijk zijn. Een lege waarde wordt None.
+    if value is None or value == '':
+        return None
+    if integer:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+    return value if isinstance(value, str) else str(value)
+
+def read_value(book):
+    # De gelezen status volgens ComicRack: 1 als hooguit de laatste pagina nog niet gelezen is
+    last_page_read = book.text('LastPageRead')
+    page_count = book.text('PageCount')
+    if last_page_read is None or page_count is None:
+        return None
+    try:
+        return 1 if int(page_count) - int(last_page_read) < 2 else 0
+    except ValueError:
+        return None
+
+class BookColumns:
+    # De waarden van de velden uit de LOOKUP_TABLE voor alle boeken, in één keer afgeleid en naar
+    # het type van de YAC kolom omgezet: per positie van het boek een tuple in de volgorde van de
+    # LOOKUP_TABLE. Zo worden Read en de datum maar één keer per boek bepaald, en kan de diff een
+    # boek veld voor veld met de ingelezen rij uit comic_info vergelijken.
+    def __init__(self, lookup_table, books=()):
+        self.fields = tuple((xml_field, sql_field, update_flag) for xml_field, (sql_field, update_flag) in lookup_table.items())
+        self.integer = tuple(sql_field.lower() in INTEGER_COLUMNS for _, sql_field, _ in self.fields)
+        self.rows = [self.book_row(book) for book in books]
+
+    def book_row(self, book):
+        values = []
+        for (xml_field, _, _), integer in zip(self.fields, self.integer):
+            if xml_field == 'Read':
+                value = read_value(book)
+            elif xml_field == 'Year':
+                value = construct_date(book)
+            else:
+                value = book.text(xml_field)
+            values.append(coerce_value(value, integer))
+        return tuple(values)
+
+    @classmethod
+    def from_rows(cls, lookup_table, rows):
+        # Met de eerder afgeleide rijen, zonder de boeken opnieuw te doorlopen
+        columns = cls(lookup_table)
+        columns.rows = rows
+        return columns
+
+    def row(self, book):
+        return self.rows[book.position]
+
+    def refresh(self, book):
+        # na een wijziging van het boek, zoals een nieuwe LastPageRead
+        self.rows[book.position] = self.book_row(book)
+
+def comic_updates(columns, book_row, comic_row, overwrite_all, debug=None, conflicts=None):
+    # Bepaalt welke comic_info velden met de waarden uit het boek bijgewerkt moeten worden.
+    # book_row is de rij van het boek uit BookColumns, comic_row de huidige rij uit comic_info in
+    # dezelfde volgorde; debug is een optionele functie voor debug berichten. Levert de lijst met
+    # velden en de lijst met nieuwe waarden. Als conflicts een lijst is, komen daarin de velden
+    # (veld, waarde in YAC, waarde in ComicRack) die verschillen maar volgens de update policy niet
+    # overschreven worden. Waarden worden vergeleken na omzetting naar het type van de kolom.
+    update_values = []
+    fields_to_update = []
+
+    for (xml_field, sql_field, update_flag), integer, xml_value, value in zip(columns.fields, columns.integer, book_row, comic_row):
+
+        if debug:
+            debug(f"\t\tParsing xml_field: {xml_field}, xml_value = {xml_value}")
+
+        # er is een xml_value bepaald voor het betreffende xml_field
+        if not xml_value:
+            continue
+
+        # Gebruik de overwrite_all variabele om te bepalen of altijd geüpdatet moet worden (uitgezonderd 'CurrentPage')
+        if xml_field != 'CurrentPage' and (overwrite_all or update_flag == UPDATE_ALTIJD):
+            fields_to_update.append(sql_field)
+            update_values.append(xml_value)
+            continue
+
+        if debug:
+            debug(f"\t\t\t\tCurrent value in DB: {sql_field} = {value}")
+
+        if (update_flag == UPDATE_INDIEN_LEEG or update_flag == UPDATE_ALS_GEWIJZIGD) and (value is None or value == '' or value == 0):
+            if debug:
+                debug(f"\t\t\t\tCurrent value is empty, add to  update query: {sql_field} = {xml_value}")
+            fields_to_update.append(sql_field)
+            update_values.append(xml_value)
+        elif update_flag == UPDATE_ALS_GEWIJZIGD and coerce_value(value, integer) != xml_value:
+            if debug:
+                debug(f"\t\t\t\tCurrent value {value} is changed, add to update query: {sql_field} = {xml_value}")
+            fields_to_update.append(sql_field)
+            update_values.append(xml_value)
+        elif conflicts is not None and update_flag == UPDATE_INDIEN_LEEG and coerce_value(value, integer) != xml_value:
+            conflicts.append((sql_field, value, xml_value))
+
+    return fields_to_update, update_values
+
+def read_status_update(book, current_read):
+    # Levert de nieuwe LastPageRead voor ComicRack als de comic in YAC gelezen is maar in ComicRack
+    # niet, anders None
+    if current_read != 1:
+        return None
+
+    # zonder bruikbaar aantal pagina's valt de gelezen status niet te bepalen
+    try:
+        page_count = int(book.text('PageCount'))
+    except (TypeError, ValueError):
+        return None
+
+    # check of in ComicRack status niet Read is
+    last_page_read = book.text('LastPageRead')
+    if last_page_read is None:
+        # Voeg het veld toe als het niet bestaat
+        return str(page_count)
+    try:
+        if page_count - int(last_page_read) > 1:
+            # update bestaande veld
+            return str(page_count - 1)
+    except ValueError:
+        pass
+    return None
+
+# Strategieën waarmee een YAC comic aan een boek uit ComicDB.xml gekoppeld wordt, in volgorde van voorrang
+MATCH_EXACT = 'exact'               # gelijk pad, of het XML pad eindigt op het volledige YAC pad
+MATCH_SUFFIX = 'suffix'             # langste gemeenschappelijke staart van minstens map en bestandsnaam
+MATCH_NAME_SIZE = 'name_size'       # gelijke bestandsnaam en bestandsgrootte
+MATCH_SERIES = 'series_number'      # gelijke genormaliseerde serie, nummer, volume en jaar
+
+# Markering in een index voor een sleutel die bij meerdere boeken hoort
+AMBIGUOUS = -1
+
+def hash_size(comic_hash):
+    # YAC slaat in comic_info.hash de sha1 (40 hex tekens) gevolgd door de bestandsgrootte op
+    if comic_hash and len(comic_hash) > 40 and comic_hash[40:].isdigit():
+        return int(comic_hash[40:])
+    return None
+
+def file_size(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def date_year(date):
+    # Het jaar uit een datum van YAC of uit construct_date (dag-maand-jaar), None zonder jaar
+    match = re.search(r'\d{4}', str(date)) if date else None
+    return match.group(0) if match else None
+
+def series_key(series, number, volume=None, year=None):
+    # Sleutel van serie, nummer, volume en jaar, ongevoelig voor hoofdletters, leestekens en
+    # voorloopnullen. Volume en jaar horen altijd bij de sleutel: een comic zonder volume of jaar
+    # matcht alleen een boek zonder volume of jaar, zodat Batman #1 uit 1940 niet aan Batman #1
+    # uit 2016 gekoppeld wordt.
+    if not series or number is None:
+        return None
+    series = re.sub(r'[\W_]+', '', remove_hidden_characters(str(series)).lower())
+    number = remove_hidden_characters(str(number)).strip().lower()
+    if not series or not number:
+        return None
+    volume = remove_hidden_characters(str(volume)).strip().lower() if volume is not None else ''
+    return series, number.lstrip('0') or '0', (volume.lstrip('0') or '0') if volume else None, year
+
+class BookIndex:
+    # Indexen op de boeken uit ComicDB.xml, eenmalig opgebouwd na het parsen, zodat elke strategie
+    # een comic in O(1) vindt of mist. Een YAC pad matcht eerst met een boek als het genormaliseerde
+    # XML pad gelijk is aan het YAC pad, of ermee eindigt; bij meerdere kandidaten wint, net als bij
+    # de lineaire zoektocht, het eerste boek in de volgorde van ComicDB.xml. Met fallback wordt
+    # daarna gezocht op de langste gemeenschappelijke staart van het pad, op bestandsnaam en
+    # grootte en op serie, nummer, volume en jaar. Die strategieën koppelen alleen bij precies één
+    # kandidaat.
+    def __init__(self, books=(), fallback=False):
+        self.books = []
+        self.keys = []          # genormaliseerd pad per positie
+        self.fallback = fallback
+        self.exact = {}         # volledig genormaliseerd pad -> positie van het boek
+        self.suffixes = {}      # staart van het pad na elke '/' -> positie van het eerste boek
+        self.shared_suffixes = set()    # staarten die in boeken met verschillende paden voorkomen
+        self.names = {}         # (bestandsnaam, grootte) -> positie of AMBIGUOUS
+        self.series = {}        # (serie, nummer, volume, jaar) -> positie of AMBIGUOUS
+        for file_name, book in books:
+            self.add(file_name, book)
+
+    def __len__(self):
+        return len(self.books)
+
+    def add(self, file_name, book):
+        position = len(self.books)
+        self.books.append(book)
+        if file_name is None:
+            self.keys.append(None)
+            return
+
+        key = path_key(file_name)
+        self.keys.append(key)
+        self.exact.setdefault(key, position)
+
+        # registreer elke staart van het pad die begint na een scheidingsteken
+        start = key.find('/')
+        while start != -1:
+            tail = key[start + 1:]
+            first = self.suffixes.setdefault(tail, position)
+            if self.fallback and first != position and self.keys[first] != key:
+                self.shared_suffixes.add(tail)
+            start = key.find('/', start + 1)
+
+        if self.fallback:
+            size = file_size(book.text('FileSize'))
+            if size is not None:
+                self.add_key(self.names, (key.rsplit('/', 1)[-1], size), position)
+            series = series_key(book.text('Series'), book.text('Number'), book.text('Volume'), date_year(book.text('Year')))
+            if series is not None:
+                self.add_key(self.series, series, position)
+
+    def add_key(self, index, key, position):
+        # Een tweede boek met een ander pad maakt de sleutel dubbelzinnig
+        first = index.setdefault(key, position)
+        if first != position and first != AMBIGUOUS and self.keys[first] != self.keys[position]:
+            index[key] = AMBIGUOUS
+
+    def match(self, file_name, size=None, series=None, number=None, volume=None, year=None):
+        # Levert (boek, strategie, dubbelzinnig): het gevonden boek en de strategie waarmee het
+        # gevonden is, of None en None. dubbelzinnig bevat de strategieën die meerdere boeken vonden.
+        key = path_key(file_name)
+
+        candidates = []
+        if key in self.exact:
+            candidates.append(self.exact[key])
+
+        # YAC paden beginnen met een '/', de staart erna moet in het XML pad voorkomen
+        suffix = key[1:] if key.startswith('/') else key
+        if suffix in self.suffixes:
+            candidates.append(self.suffixes[suffix])
+
+        if candidates:
+            return self.books[min(candidates)], MATCH_EXACT, ()
+        if not self.fallback:
+            return None, None, ()
+
+        ambiguous = []
+
+        # de langste staart van het YAC pad die ook in een XML pad voorkomt, met minstens één map
+        start = suffix.find('/')
+        while start != -1 and '/' in suffix[start + 1:]:
+            tail = suffix[start + 1:]
+            if tail in self.suffixes:
+                if tail not in self.shared_suffixes:
+                    return self.books[self.suffixes[tail]], MATCH_SUFFIX, ()
+                ambiguous.append(MATCH_SUFFIX)
+                break
+            start = suffix.find('/', start + 1)
+
+        for strategy, index, index_key in (
+                (MATCH_NAME_SIZE, self.names, (key.rsplit('/', 1)[-1], size) if size is not None else None),
+                (MATCH_SERIES, self.series, series_key(series, number, volume, year))):
+            position = index.get(index_key) if index_key is not None else None
+            if position == AMBIGUOUS:
+                ambiguous.append(strategy)
+            elif position is not None:
+                return self.books[position], strategy, ()
+
+        return None, None, tuple(ambiguous)
+
+    def find(self, file_name, size=None, series=None, number=None, volume=None, year=None):
+        return self.match(file_name, size, series, number, volume, year)[0]
+
+    def copy(self):
+        # Kopie met eigen boeken en gedeelde indexen, zodat een library de LastPageRead van de
+        # boeken kan aanpassen zonder dat andere libraries die wijziging zien. De indexen worden
+        # na het opbouwen niet meer gewijzigd en kunnen gedeeld worden.
+        return BookIndex.from_state([BookRecord.from_tuple(book.to_tuple()) for book in self.books], self.state(), self.fallback)
+
+    def state(self):
+        # De indexen in een vorm die met marshal opgeslagen kan worden, zie from_state
+        return self.keys, self.exact, self.suffixes, self.shared_suffixes, self.names, self.series
+
+    @classmethod
+    def from_state(cls, books, state, fallback=False):
+        index = cls(fallback=fallback)
+        index.books = books
+        index.keys, index.exact, index.suffixes, index.shared_suffixes, index.names, index.series = state
+        return index
+
+class BatchWriter:
+    # Verzamelt de UPDATE queries van de comics en schrijft ze per batch weg in één transactie.
+    # Queries met dezelfde velden worden gegroepeerd en met executemany uitgevoerd. Komt een Id
+    # opnieuw voor dat al in de batch staat, dan begint een nieuwe reeks groepen, zodat updates
+    # van dezelfde comic_info in de oorspronkelijke volgorde worden uitgevoerd. Mislukt een
+    # groep, dan wordt die via een savepoint teruggedraaid en rij voor rij opnieuw uitgevoerd,
+    # zodat alleen de foute rij wordt overgeslagen en de rest van de batch behouden blijft.
+    # Is de database vergrendeld door een ander proces, dan wordt de hele batch tot busy_retries
+    # keer opnieuw geprobeerd.
+    def __init__(self, conn, logger, batch_size=500, dry_run=False, metrics=None, busy_retries=0):
+        self.conn = conn
+        self.logger = logger
+        self.metrics = metrics if metrics is not None else NullMetrics()
+        self.batch_size = batch_size    # 0 of None: alles in één transactie aan het einde
+        self.dry_run = dry_run          # tel de updates alleen, voer ze niet uit
+        self.busy_retries = busy_retries
+        self.pending = []               # reeksen van {query: rijen}, in volgorde uit te voeren
+        self.pending_ids = set()        # Ids in de laatste reeks
+        self.pending_count = 0
+        self.written = 0
+        self.failed = 0
+        self.failed_ids = set()
+        self.rolled_back = False        # een hele batch is teruggedraaid, niet alleen een enkele rij
+
+    def add(self, query, values):
+        # het Id van comic_info is de laatste waarde van de query
+        values = tuple(values)
+        if not self.pending or values[-1] in self.pending_ids:
+            self.pending.append({})
+            self.pending_ids = set()
+        self.pending[-1].setdefault(query, []).append(values)
+        self.pending_ids.add(values[-1])
+        self.pending_count += 1
+        if self.batch_size and self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        batch, count = self.pending, self.pending_count
+        self.pending = []
+        self.pending_ids = set()
+        self.pending_count = 0
+
+        if self.dry_run:
+            self.written += count
+            return
+
+        with self.metrics.timer('update'):
+            self.write_batch(batch, count)
+
+    def write_batch(self, batch, count):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return self.try_batch(batch, count)
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                if is_busy(e) and attempt < self.busy_retries:
+                    self.logger.info(f"The YAC database is locked ({e}), retrying {count} updates.")
+                    time.sleep(0.5 * 2 ** attempt)
+                    continue
+                self.logger.error(f"Error while writing {count} updates to the YAC database: {e}")
+                self.failed += count
+                self.rolled_back = True
+                self.failed_ids.update(values[-1] for group in batch for rows in group.values() for values in rows)
+                return
+
+    def try_batch(self, batch, count):
+        written = 0
+        self.conn.execute("BEGIN")
+        for group in batch:
+            for query, rows in group.items():
+                self.conn.execute("SAVEPOINT batch")
+                try:
+                    self.conn.executemany(query, rows)
+                    self.conn.execute("RELEASE batch")
+                    written += len(rows)
+                except sqlite3.Error as e:
+                    # een vergrendelde database geldt voor de hele batch, niet voor een rij
+                    if is_busy(e):
+                        raise
+                    self.conn.execute("ROLLBACK TO batch")
+                    self.conn.execute("RELEASE batch")
+                    self.logger.debug(f"\t\tBatch update failed ({e}), retrying {len(rows)} rows one by one")
+                    written += self.write_rows(query, rows)
+        self.conn.commit()
+
+        self.written += written
+        self.failed += count - written
+        self.logger.debug(f"\t\tCommitted {written} of {count} updates to the YAC database")
+
+    def write_rows(self, query, rows):
+        written = 0
+        for values in rows:
+            self.conn.execute("SAVEPOINT row")
+            try:
+                self.conn.execute(query, values)
+                self.conn.execute("RELEASE row")
+                written += 1
+            except sqlite3.Error as e:
+                if is_busy(e):
+                    raise
+                self.conn.execute("ROLLBACK TO row")
+                self.conn.execute("RELEASE row")
+                self.logger.error(f"Error while updating the YAC database for Id {values[-1]}: {e}")
+                self.failed_ids.add(values[-1])
+        return written
+
+class ComicTable:
+    # Compacte tabel met de huidige comic_info waarden van de comics, geïndexeerd op ComicInfoId.
+    # Per comic wordt alleen een tuple met de waarden in de volgorde van columns bewaard.
+    def __init__(self, columns):
+        self.columns = columns
+        self.position = {column.lower(): index for index, column in enumerate(columns)}
+        self.comics = []    # (ComicInfoId, Path) in de volgorde van de comic tabel
+        self.row_ids = []   # comic.Id van elke comic in comics
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.comics)
+
+    def add(self, comic_id, path, values, row_id=None):
+        self.comics.append((comic_id, path))
+        self.row_ids.append(row_id)
+        self.rows[comic_id] = tuple(values)
+
+    def row(self, comic_id):
+        return self.rows.get(comic_id) or (None,) * len(self.columns)
+
+    def value(self, comic_id, column):
+        row = self.rows.get(comic_id)
+        if row is None:
+            return None
+        return row[self.position[column.lower()]]
+
+    def update(self, comic_id, values):
+        # verwerk een update ook in de tabel, zodat comics met dezelfde ComicInfoId de nieuwe waarden zien
+        row = list(self.rows.get(comic_id, (None,) * len(self.columns)))
+        for column, value in values.items():
+            row[self.position[column.lower()]] = value
+        self.rows[comic_id] = tuple(row)
 
 class CRConverter:
     # lookup tabel, True: update alleen als leeg, False: altijd updaten.
@@ -67,224 +507,665 @@ class CRConverter:
         'Year': ('Date', UPDATE_ALS_GEWIJZIGD)
     }
 
-    def __init__(self, db_location, xml_location, progress_bar=None, log_text=None, overwrite_all=None, log_level=logging.INFO, verbose=False, syncread=False):
+    # kolommen uit comic_info die in één keer voor alle comics ingelezen worden, plus de hash met
+    # de bestandsgrootte voor het matchen op bestandsnaam en grootte
+    COMIC_INFO_COLUMNS = tuple(sql_field for sql_field, _ in LOOKUP_TABLE.values()) + ('Hash',)
+
+    def __init__(self, db_location, xml_location, progress=None, log_handler=None, overwrite_all=False, log_level=logging.INFO, verbose=False, syncread=False, batch_size=500, preload_chunk_size=0, streaming=False, cancel_event=None, incremental=False, state_file=STATE_FILE, dry_run=False, workers=0, shard_size=1000, metrics=False, metrics_file=None, profile_file=None, fallback_matching=False, xml_cache=False, cache_file=CACHE_FILE, fast_scan=False, plan_file=None, journal_mode='wal', cache_size_mb=64, mmap_size_mb=256, temp_store_memory=True, busy_timeout=5000, busy_retries=3, resume=False):
         self.db_location = db_location
         self.xml_location = xml_location
         self.conn = None
-        self.root = None
-        self.tree = None
-        self.progress_bar = progress_bar
-        self.log_text = log_text
+        self.book_index = None
+        self.progress = progress            # functie die (waarde, maximum) van de voortgang ontvangt
+        self.cancel_event = cancel_event    # threading.Event waarmee de conversie afgebroken kan worden
         self.overwrite_all = overwrite_all
         self.log_level = log_level
         self.verbose = verbose
         self.syncread = syncread
+        self.batch_size = batch_size
+        self.writer = None
+        self.busy_retries = busy_retries    # aantal keer dat een batch opnieuw geprobeerd wordt als de database vergrendeld is
+        self.db_profile = ConnectionProfile(journal_mode, cache_size_mb, mmap_size_mb, temp_store_memory, busy_timeout, dry_run)
+        self.preload_chunk_size = preload_chunk_size    # 0: alle comics in één keer inlezen
+        self.comic_table = None
+        self.book_columns = None        # de velden van alle boeken in het type van YAC, zie BookColumns
+        self.streaming = streaming      # lees ComicDB.xml stapsgewijs in zonder DOM
+        self.fast_scan = fast_scan      # lees ComicDB.xml met scan_books, met ElementTree als terugval
+        self.plan = None                # de berekende wijzigingen van de run, zie ChangePlan
+        self.plan_file = plan_file      # JSON bestand waarin het plan voor het uitvoeren bewaard wordt
+        self.defer_xml = False          # ComicDB.xml niet zelf bijwerken, zie MultiConverter
+        self.dry_run = dry_run          # toon alleen wat er zou veranderen, schrijf niets weg
+        self.workers = workers          # aantal processen voor het matchen, 0 of 1: alles in dit proces
+        self.shard_size = shard_size    # aantal comics per taak voor een worker
+        self.fallback_matching = fallback_matching  # zoek ook op staart van het pad, naam en grootte, serie en nummer
+        self.xml_cache = xml_cache      # bewaar de ingelezen boeken en de index tot ComicDB.xml verandert
+        self.cache_file = cache_file
         self.number_updated = 0
         self.number_missing = 0
         self.number_nochange = 0
         self.number_syncread = 0
+        self.number_skipped = 0
+        self.number_ambiguous = 0
+        self.match_counts = {}          # aantal comics per strategie waarmee het boek gevonden is
+        self.incremental = incremental  # sla comics over die sinds de vorige run niet veranderd zijn
+        self.state_file = state_file
+        self.state = None
+        self.state_changes = {}
+        self.resume = resume            # ga verder na het checkpoint van een afgebroken run
+        self.checkpoint = None
+        self.resume_id = None           # comic.Id waarna deze run begint
+        self.row_id = None              # comic.Id van de laatst verwerkte comic
+        self.debug = False      # alleen debug berichten opmaken als het DEBUG niveau aan staat
+        self.metrics_file = metrics_file    # JSON bestand voor het rapport met de metingen
+        self.profile_file = profile_file    # bestand voor de cProfile statistieken van de run
+        self.metrics = Metrics() if metrics or metrics_file else NullMetrics()
 
         # Setup logging
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
 
-        # check of er niet al een handler is geinstalleerd
-        if not self.logger.handlers:
-            gui_handler = GUIHandler(log_text)
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            gui_handler.setFormatter(formatter)
-            self.logger.addHandler(gui_handler)
+        # check of de handler niet al is geinstalleerd
+        if log_handler is not None and log_handler not in self.logger.handlers:
+            self.logger.addHandler(log_handler)
 
         # zet logging level
         self.logger.setLevel(self.log_level)
+        self.debug = self.logger.isEnabledFor(logging.DEBUG)
 
 
     def connect_to_db(self):
+        # sqlite3.connect zou anders een nieuwe, lege database aanmaken
+        if not os.path.isfile(self.db_location):
+            self.logger.error(f"YAC database not found: {self.db_location}")
+            return
+
         try:
-            self.conn = sqlite3.connect(self.db_location)
+            with self.metrics.timer('connect'):
+                self.conn = self.db_profile.connect(self.db_location, self.logger)
+            self.metrics.trace(self.conn)
             self.logger.info("Connected to the YAC database.")
         except sqlite3.Error as e:
             self.logger.error(f"Error while connecting to YAC database: {e}")
+            return
+
+        self.check_indexes()
+
+    def check_indexes(self):
+        # Meld toegangspaden zonder index; de index wordt niet aangemaakt, het schema is van YACReader
+        for table, column, required in missing_indexes(self.conn):
+            if required:
+                self.logger.warning(f"{table}.{column} is not indexed, every update searches the whole table.")
+            else:
+                self.logger.debug(f"{table}.{column} is not indexed.")
+
+    def close_db(self):
+        self.db_profile.close(self.conn, self.logger)
 
     def parse_xml(self):
+        if self.xml_cache and self.load_xml_cache():
+            return
+
         try:
-            self.tree = ET.parse(self.xml_location)
-            self.root = self.tree.getroot()
+            with self.metrics.timer('parse'):
+                books = self.scan_xml() if self.fast_scan else None
+                if books is None and self.streaming:
+                    books = list(iter_books(self.xml_location))
+                elif books is None:
+                    # de DOM is alleen nodig voor het inlezen, ComicDB.xml wordt via de patch writer bijgewerkt
+                    _, books = read_books(self.xml_location, keep_element=False)
             self.logger.info("ComicRack XML file parsed succesfully.")
+            self.build_index(books)
         except ET.ParseError as e:
             self.logger.error(f"Error while parsing XML file: {e}")
+            return
 
+        if self.xml_cache:
+            self.save_xml_cache()
 
-    def find_book_by_file(self, file_name):
-        normalized_file_name = remove_hidden_characters(normalize_path(file_name))
-        for book in self.root.find('Books').findall('Book'):
-            book_file = remove_hidden_characters(normalize_path(book.get('File')))
-            if normalized_file_name in book_file:
-                return book
-        self.logger.debug(f"Did not find XML book entry for {file_name}")
-        return None
+    def scan_xml(self):
+        # Levert None als de scanner het bestand niet begrijpt, dan leest ElementTree het in
+        try:
+            return scan_books(self.xml_location)
+        except ScanError as e:
+            self.logger.info(f"Fast scan of ComicDB.xml not possible ({e}), using ElementTree.")
+            return None
 
-    def construct_date(self, book):
-        # Construeert een datumstring uit de jaar-, maand- en dagvelden.
-        # Begin met een lege datumstring
-        date_str = None
-
-        year = book.find('Year').text if book.find('Year') is not None else None
-        if year is not None:
-            date_str = year
-            month = book.find('Month').text if book.find('Month') is not None else None
-            if month is not None:
-                date_str = f"{month}-{date_str}"
-                day = book.find('Day').text if book.find('Day') is not None else None
-                if day:
-                    date_str = f"{day}-{date_str}"
-
-        return date_str
+    def cache_settings(self):
+        # De cache hoort bij deze velden, deze manier van matchen en dit platform (normcase)
+        return (BOOK_FIELDS, self.fallback_matching, os.name)
 
-    def update_comic_info(self, comic_id, book, path):
-        cursor = self.conn.cursor()
-        update_query = "UPDATE comic_info SET "
-        update_values = []
-        fields_to_update = []
+    def load_xml_cache(self):
+        with self.metrics.timer('cache'):
+            payload = load_cache(self.cache_file, self.xml_location, self.cache_settings())
+            if payload is None:
+                return False
+            books, index = payload
+            self.book_index = BookIndex.from_state([BookRecord.from_tuple(book) for book in books], index, self.fallback_matching)
+        self.logger.info(f"Loaded {len(self.book_index)} ComicRack books from the cache, ComicDB.xml did not change.")
+        return True
 
-        for xml_field, (sql_field, update_flag) in self.LOOKUP_TABLE.items():
+    def save_xml_cache(self):
+        payload = ([book.to_tuple() for book in self.book_index.books], self.book_index.state())
+        try:
+            with self.metrics.timer('cache'):
+                save_cache(self.cache_file, self.xml_location, self.cache_settings(), payload)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not write the cache of ComicDB.xml: {e}")
 
-            self.logger.debug(f"\t\tParsing xml_field: {xml_field}")
 
-            # bepaal xml_value, verwerk eerst speciale cases van xml_field
-            if xml_field == 'Read':
-                last_page_read = book.find('LastPageRead').text if book.find('LastPageRead') is not None else None
-                page_count = book.find('PageCount').text if book.find('PageCount') is not None else None
-                if last_page_read is not None and page_count is not None:
-                    if int(page_count) - int(last_page_read) < 2:
-                        xml_value = 1
-                    else:
-                        xml_value = 0
-
-                    self.logger.debug(f"\t\t\t\tRead status: {last_page_read}/{page_count}, xml_value = {xml_value}")
-                else:
-                    continue
+    def load_comics(self, after_id=None, limit=None):
+        # Lees de comics en alle gemapte comic_info kolommen in met één query
+        columns = ", ".join(f"ci.{column}" for column in self.COMIC_INFO_COLUMNS)
+        query = f"SELECT c.Id, c.ComicInfoId, c.Path, {columns} FROM comic c LEFT JOIN comic_info ci ON ci.Id = c.ComicInfoId"
+        parameters = []
+        if after_id is not None:
+            query += " WHERE c.Id > ?"
+            parameters.append(after_id)
+        query += " ORDER BY c.Id"
+        if limit:
+            query += " LIMIT ?"
+            parameters.append(limit)
 
-            elif xml_field == 'Year':
-                xml_value = self.construct_date(book)
-                self.logger.debug(f"\t\t\t\tDate constructed: {xml_value}")
-            else:
-                xml_value = book.find(xml_field).text if book.find(xml_field) is not None else None
-
-            # er is een xml_value bepaald voor het betreffende xml_field. 
-            if xml_value:
-                # Gebruik de overwrite_all variabele om te bepalen of altijd geüpdatet moet worden (uitgezonderd 'CurrentPage')
-                if xml_field != 'CurrentPage' and (self.overwrite_all.get() or update_flag == UPDATE_ALTIJD):
-                    fields_to_update.append(f"{sql_field} = ?")
-                    update_values.append(xml_value)
-                else:
-                    cursor.execute(f"SELECT {sql_field} FROM comic_info WHERE Id = ?", (comic_id,))
-                    current_value = cursor.fetchone()
-
-                    self.logger.debug(f"\t\t\t\tCurrent value in DB: {sql_field} = {current_value}")
-
-                    if (update_flag == UPDATE_INDIEN_LEEG or update_flag == UPDATE_ALS_GEWIJZIGD) and (current_value is None or current_value[0] is None or current_value[0] == '' or current_value[0] == 0):
-                        self.logger.debug(f"\t\t\t\tCurrent value is empty, add to  update query: {sql_field} = {xml_value}")
-                        fields_to_update.append(f"{sql_field} = ?")
-                        update_values.append(xml_value)
-                    elif update_flag == UPDATE_ALS_GEWIJZIGD and (current_value[0] != xml_value):
-                        self.logger.debug(f"\t\t\t\tCurrent value {current_value} is changed, add to update query: {sql_field} = {xml_value}")
-                        fields_to_update.append(f"{sql_field} = ?")
-                        update_values.append(xml_value)
+        table = ComicTable(self.COMIC_INFO_COLUMNS)
+        last_id = None
+        with self.metrics.timer('select'):
+            for row in self.conn.execute(query, parameters):
+                last_id = row[0]
+                table.add(row[1], row[2], row[3:], row[0])
+        return table, last_id
 
-        if fields_to_update:
-            update_query += ", ".join(fields_to_update)
-            update_query += " WHERE Id = ?"
-            update_values.append(comic_id)
+    def iter_comic_tables(self):
+        # Levert de comics in één tabel, of bij een preload_chunk_size in delen van die grootte
+        if not self.preload_chunk_size:
+            table, _ = self.load_comics(self.resume_id)
+            yield table
+            return
 
-            if self.verbose is True:
-                query = combine_query_and_values(update_query, update_values)
-                self.logger.info(f"QUERY: {query}")
-            elif self.verbose is False and self.log_level is logging.DEBUG:
-                self.logger.debug(f"\t\tUPDATE of DB: {update_query} met {update_values}")
+        last_id = self.resume_id
+        while True:
+            table, last_id = self.load_comics(last_id, self.preload_chunk_size)
+            if not table:
+                return
+            # de updates uit eerdere delen zijn nog niet uitgevoerd
+            self.plan.overlay(table)
+            yield table
 
-            try:
-                cursor.execute(update_query, tuple(update_values))
-                self.conn.commit()
-                self.number_updated += 1
-            except sqlite3.Error as e:
-                self.logger.error(f"Error while updating the YAC database: {e}")
+    def build_index(self, books):
+        # Bouw eenmalig de index op de bestandsnamen, zodat elke comic in O(1) gevonden wordt
+        with self.metrics.timer('index'):
+            self.book_index = BookIndex(((book.File, book) for book in books), self.fallback_matching)
+        self.logger.info(f"Indexed {len(self.book_index)} ComicRack books.")
+
+    def build_columns(self):
+        # Leid de velden van alle boeken in één keer af voor de diff
+        with self.metrics.timer('columns'):
+            self.book_columns = BookColumns(self.LOOKUP_TABLE, self.book_index.books)
+
+    def find_book_by_file(self, file_name, comic_id=None):
+        return self.match_book(comic_id, file_name)[0]
+
+    def match_book(self, comic_id, path):
+        # Zoek het boek bij een comic; naast het pad worden de grootte uit de hash en de serie, het
+        # nummer, het volume en het jaar uit comic_info gebruikt. Levert (boek, strategie,
+        # dubbelzinnige strategieën).
+        table = self.comic_table
+        with self.metrics.timer('match'):
+            book, strategy, ambiguous = self.book_index.match(
+                path, hash_size(table.value(comic_id, 'Hash')), table.value(comic_id, 'Series'), table.value(comic_id, 'Number'),
+                table.value(comic_id, 'Volume'), date_year(table.value(comic_id, 'Date')))
+        if book is None and self.debug:
+            self.logger.debug(f"Did not find XML book entry for {path}")
+        return book, strategy, ambiguous
+
+    def construct_date(self, book):
+        return construct_date(book)
+
+    def update_comic_info(self, comic_id, book, path):
+        debug = self.logger.debug if self.debug else None
+        conflicts = []
+        with self.metrics.timer('diff'):
+            fields_to_update, update_values = comic_updates(self.book_columns, self.book_columns.row(book), self.comic_table.row(comic_id), self.overwrite_all, debug, conflicts)
+        self.apply_comic_updates(comic_id, path, fields_to_update, update_values, conflicts)
+
+    def apply_comic_updates(self, comic_id, path, fields_to_update, update_values, conflicts=()):
+        # Neem de updates op in het plan; ze worden pas na het verwerken van alle comics uitgevoerd
+        for field, yac_value, comicrack_value in conflicts:
+            self.plan.add_conflict(comic_id, path, field, yac_value, comicrack_value)
+
+        if fields_to_update:
+            self.comic_table.update(comic_id, dict(zip(fields_to_update, update_values)))
+            self.metrics.count_fields(fields_to_update)
+            self.plan.add_yac_update(comic_id, path, fields_to_update, update_values, self.row_id)
         else:
-            self.logger.debug(f"\t\tUPDATE: No values found for update of Id: {comic_id} at ({path})")
+            if self.debug:
+                self.logger.debug(f"\t\tUPDATE: No values found for update of Id: {comic_id} at ({path})")
             self.number_nochange += 1
 
+    def write_comic_update(self, comic_id, fields_to_update, update_values):
+        update_query = "UPDATE comic_info SET "
+        update_query += ", ".join(f"{sql_field} = ?" for sql_field in fields_to_update)
+        update_query += " WHERE Id = ?"
+        update_values = list(update_values) + [comic_id]
+
+        if self.verbose is True:
+            query = combine_query_and_values(update_query, update_values)
+            self.logger.info(f"QUERY: {query}")
+        elif self.verbose is False and self.debug:
+            self.logger.debug(f"\t\tUPDATE of DB: {update_query} met {update_values}")
+
+        self.writer.add(update_query, update_values)
+
     def sync_read_status(self, comic_id, book, path):
         # lees de 'Read' value in YAC
-        cursor = self.conn.cursor()
-        cursor.execute(f"SELECT read FROM comic_info WHERE Id = ?", (comic_id,))
-        current_value = cursor.fetchone()
+        last_page_read = read_status_update(book, self.comic_table.value(comic_id, 'Read'))
+        if last_page_read is not None:
+            if self.debug:
+                self.logger.debug(f"READ in YAC, but ComicDB.XML page {book.LastPageRead}/{book.PageCount}: Update XML file for comic_id {comic_id}")
+            self.apply_read_status(book, path, last_page_read, comic_id)
 
-        if current_value is not None and current_value[0] == 1:
-            # check of in ComicRack status niet Read is
-            last_page_read = book.find('LastPageRead').text if book.find('LastPageRead') is not None else None
-            page_count = book.find('PageCount').text if book.find('PageCount') is not None else None
+    def read_status_conflict(self, comic_id, path):
+        # gelezen in YAC maar niet in ComicRack, zonder Sync Read status wordt dat alleen gemeld
+        self.plan.add_conflict(comic_id, path, 'Read', 1, 0)
 
-            if last_page_read is None or (page_count is not None and int(page_count)-int(last_page_read) > 1):
-                self.logger.debug(f"READ in YAC, but ComicDB.XML page {last_page_read}/{page_count}: Update XML file for comic_id {comic_id}")
+    def apply_read_status(self, book, path, last_page_read, comic_id=None):
+        if not self.syncread:
+            self.read_status_conflict(comic_id, path)
+            return
 
-                if last_page_read is not None:
-                    # update bestaande veld
-                    book.find('LastPageRead').text = str(int(page_count)-1)
-                    self.number_syncread += 1
-                else:
-                    # Voeg het veld toe als het niet bestaat
-                    new_last_page_read = ET.SubElement(book, 'LastPageRead')
-                    new_last_page_read.text = str(page_count)
-                    self.number_syncread += 1
-
-                self.logger.info(F"SYNC Read status in ComicRack DB for {path}")    
-                self.tree.write(self.xml_location, encoding='utf-8', xml_declaration=True)
+        book.LastPageRead = last_page_read
+        self.book_columns.refresh(book)
+        self.number_syncread += 1
+
+        self.logger.info(F"SYNC Read status in ComicRack DB for {path}")
+
+        # de XML wordt eenmalig aan het einde van de run bijgewerkt
+        self.plan.add_xml_update(book.position, book.File, book.LastPageRead)
 
     def process_comics(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT ComicInfoId, Path FROM comic")
-        comics = cursor.fetchall()
+        self.plan = ChangePlan(self.db_location, self.xml_location, track_pending=bool(self.preload_chunk_size))
+        self.start_checkpoint()
+
+        with self.metrics.timer('select'):
+            cursor = self.conn.cursor()
+            if self.resume_id is None:
+                cursor.execute("SELECT COUNT(*) FROM comic")
+            else:
+                cursor.execute("SELECT COUNT(*) FROM comic WHERE Id > ?", (self.resume_id,))
+            total_comics = cursor.fetchone()[0]
 
-        total_comics = len(comics)
         self.logger.info(f"Processing {total_comics} comics...")
-        self.progress_bar['value'] = 0
-        self.progress_bar['maximum'] = total_comics
+        self.report_progress(0, total_comics)
         self.number_updated = 0
         self.number_missing = 0
         self.number_nochange = 0
         self.number_syncread = 0
+        self.number_skipped = 0
+        self.number_ambiguous = 0
+        self.match_counts = {}
+        self.build_columns()
+        if self.incremental:
+            self.load_state()
 
-        for index, (comic_id, path) in enumerate(comics):
-            book = self.find_book_by_file(path)
+        # meld de voortgang ongeveer elke halve procent, niet voor elke comic
+        progress_step = max(1, total_comics // 200)
 
-            if book is not None:
-                xmlbook = book.attrib['File']
-                self.logger.debug(f"MATCH:  DB path: {path}, met Id {comic_id:>8} --- XML File: {xmlbook}")
-                self.update_comic_info(comic_id, book, path)
-                
-                # sync read status naar ComicRack indien de optie aan staat
-                if self.syncread:
-                    self.sync_read_status(comic_id, book, path)
+        if self.workers > 1:
+            with self.metrics.timer('parallel'):
+                self.process_parallel(total_comics)
+        else:
+            for index, (self.row_id, (comic_id, path)) in enumerate(self.iter_comics(), 1):
+                if self.is_cancelled():
+                    self.logger.warning(f"Processing cancelled after {index - 1} of {total_comics} comics, the changes so far are saved.")
+                    break
 
-            else:
-                self.logger.warning(f"No ComicRack info found for ComicInfoId {comic_id:>8}: {path}")
-                self.number_missing += 1
+                with self.metrics.comic_timer():
+                    self.process_comic(comic_id, path)
+                self.plan.last_id = self.row_id
+
+                # Update de voortgangsbalk
+                if index % progress_step == 0 or index == total_comics:
+                    self.report_progress(index, total_comics)
 
-            # Update de voortgangsbalk
-            self.progress_bar['value'] = index + 1
-            self.progress_bar.update()
+        self.logger.info(f"Change plan: {len(self.plan.yac_updates)} comic updates for YAC, {len(self.plan.xml_updates)} read status changes for ComicRack, {len(self.plan.conflicts)} conflicts.")
+        if self.plan_file:
+            self.save_plan(self.plan_file)
+
+        self.apply_plan(self.plan)
+
+        if self.state is not None and not self.dry_run:
+            self.save_state()
+
+        # na een volledige run is er niets meer om te hervatten
+        if self.is_cancelled() or self.writer.rolled_back:
+            if self.checkpoint_id is not None and not self.dry_run:
+                self.logger.info(f"Use resume to continue after comic Id {self.checkpoint_id}.")
+        else:
+            self.clear_checkpoint()
+
+        if self.dry_run:
+            self.logger.info(f"Dry run: {self.writer.written} comic updates for YAC and {self.number_syncread} read status changes for ComicRack were not written.")
 
         self.logger.info(f"Processing {total_comics} comics completed; {self.number_nochange} unchanged, {self.number_updated} updated, and {self.number_missing} no ComicRack info found.")
+        fallback = {strategy: count for strategy, count in self.match_counts.items() if strategy != MATCH_EXACT}
+        if fallback:
+            self.logger.info("Matched comics without an exact path: " + ", ".join(f"{count} by {strategy}" for strategy, count in fallback.items()) + ".")
+        if self.number_ambiguous:
+            self.logger.info(f"{self.number_ambiguous} comics matched several ComicRack books and were not updated.")
+        if self.incremental:
+            self.logger.info(f"Skipped {self.number_skipped} comics that did not change since the previous run.")
         if self.syncread:
             self.logger.info(f"Synchronized read status for {self.number_syncread} comics in ComicRack.")
         self.logger.info("All done!")
 
+    def start_checkpoint(self):
+        # Een hervatte run gaat verder na het checkpoint, met de gelezen status die de afgebroken run
+        # nog niet in ComicDB.xml had geschreven. Anders wordt een oud checkpoint eerst verwijderd.
+        self.checkpoint = Checkpoint(self.state_file, self.db_location, (self.syncread, self.overwrite_all, self.fallback_matching, repr(self.LOOKUP_TABLE)))
+        self.checkpoint_id = None
+        self.resume_id = None
+        if not self.resume:
+            self.clear_checkpoint()
+            return
+
+        try:
+            with self.metrics.timer('state'):
+                saved = self.checkpoint.load()
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.warning(f"Could not read the checkpoint of the previous run, processing all comics: {e}")
+            return
+        if saved is None:
+            self.logger.info("No checkpoint of an interrupted run found, processing all comics.")
+            return
+
+        self.resume_id, xml_updates = saved
+        self.checkpoint_id = self.resume_id
+        for position, (file_name, last_page_read) in xml_updates.items():
+            self.plan.add_xml_update(position, file_name, last_page_read)
+        if xml_updates:
+            self.check_xml_updates(self.plan)
+        self.logger.info(f"Resuming the interrupted run after comic Id {self.resume_id}, with {len(self.plan.xml_updates)} pending read status changes for ComicRack.")
+
+    def save_checkpoint(self, last_id, xml_updates):
+        # Het checkpoint schuift niet verder na een teruggedraaide batch, een hervatte run begint daar.
+        # Een overgeslagen rij houdt het checkpoint niet tegen, die staat in failed_ids.
+        if self.checkpoint is None or self.dry_run or self.writer.rolled_back or last_id is None:
+            return
+        try:
+            with self.metrics.timer('state'):
+                self.checkpoint.save(last_id, xml_updates)
+            self.checkpoint_id = last_id
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not save the checkpoint of this run: {e}")
+
+    def clear_checkpoint(self):
+        if self.checkpoint is None or self.dry_run:
+            return
+        try:
+            with self.metrics.timer('state'):
+                self.checkpoint.clear()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not remove the checkpoint of the previous run: {e}")
+
+    def save_plan(self, plan_file):
+        try:
+            self.plan.save(plan_file)
+            self.logger.info(f"Change plan written to {plan_file}.")
+        except OSError as e:
+            self.logger.warning(f"Could not write the change plan to {plan_file}: {e}")
+
+    def apply_plan(self, plan):
+        # Voer het plan in twee keer uit: eerst alle updates voor YAC in batches, daarna de gelezen
+        # status in ComicDB.xml in één keer. Na elke gecommitte batch wordt het checkpoint bijgewerkt.
+        self.writer = BatchWriter(self.conn, self.logger, self.batch_size, self.dry_run, self.metrics, self.busy_retries)
+        checkpoints = self.checkpoint is not None and len(plan.row_ids) == len(plan.yac_updates)
+        for index, (comic_id, _, fields_to_update, update_values) in enumerate(plan.yac_updates):
+            self.write_comic_update(comic_id, fields_to_update, update_values)
+            if checkpoints and not self.writer.pending:
+                self.save_checkpoint(plan.row_ids[index], plan.xml_updates)
+        self.writer.flush()
+        self.number_updated = self.writer.written
+        if checkpoints:
+            self.save_checkpoint(plan.last_id, plan.xml_updates)
+
+        if plan.xml_updates and not self.defer_xml:
+            self.write_xml(plan.read_status())
+            if checkpoints:
+                self.save_checkpoint(plan.last_id, {})
+
+    def write_xml(self, read_status):
+        # Schrijf alle gewijzigde LastPageRead waarden in één keer weg in ComicDB.xml
+        changes = len(read_status)
+        if self.dry_run:
+            self.logger.info(f"Dry run: ComicDB.xml not updated, {changes} books pending.")
+            return
+
+        with self.metrics.timer('xml_write'):
+            patched = write_read_status(self.xml_location, read_status)
+        if patched:
+            self.logger.info(f"Updated {changes} books in ComicDB.xml.")
+        else:
+            self.logger.info(f"Updated {changes} books in ComicDB.xml (rewritten completely).")
+
+        # de boeken in het geheugen bevatten de nieuwe LastPageRead al, de cache kan direct mee
+        if self.xml_cache:
+            self.save_xml_cache()
+
+    def iter_comics(self):
+        # Levert (comic.Id, (ComicInfoId, Path)) in de volgorde van comic.Id
+        for self.comic_table in self.iter_comic_tables():
+            yield from zip(self.comic_table.row_ids, self.comic_table.comics)
+
+    def report_progress(self, value, maximum):
+        if self.progress is not None:
+            self.progress(value, maximum)
+
+    def is_cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def load_state(self):
+        # De staat geldt alleen voor dezelfde instellingen en dezelfde LOOKUP_TABLE
+        self.state = SyncState(self.state_file, self.db_location, (self.syncread, repr(self.LOOKUP_TABLE)))
+        self.state_changes = {}
+        try:
+            with self.metrics.timer('state'):
+                self.state.load()
+            self.logger.info(f"Loaded the state of {len(self.state.comics)} comics from the previous run.")
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not read the state of the previous run, processing all comics: {e}")
+            self.state.comics = {}
+
+    def save_state(self):
+        # Bewaar alleen de staat van comics waarvan de updates ook echt zijn weggeschreven
+        changes = {key: value for key, value in self.state_changes.items() if key[0] not in self.writer.failed_ids}
+        try:
+            with self.metrics.timer('state'):
+                self.state.save(changes)
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not save the state of this run: {e}")
+        self.state_changes = {}
+
+    def fingerprints(self, comic_id, path, book):
+        book_print = fingerprint((book.File,) + tuple(getattr(book, field) for field in BOOK_FIELDS))
+        comic_print = fingerprint(self.comic_table.rows.get(comic_id, ()))
+        return book_print, comic_print
+
+    def process_parallel(self, total_comics):
+        # Het zoeken van de boeken en het bepalen van de updates gebeurt in een pool van processen,
+        # het wegschrijven blijft hier in één writer. Een comic waarvan de ComicInfoId of het boek al
+        # eerder in deze run is verwerkt wordt hier opnieuw berekend, omdat de worker de wijzigingen
+        # van die eerdere comic niet kent.
+        from cr_parallel import ParallelMatcher
+
+        # de workers krijgen de al opgebouwde index en afgeleide velden mee in plaats van die zelf op te bouwen
+        books = [book.to_tuple() for book in self.book_index.books]
+        matcher = ParallelMatcher(books, self.book_index.state(), self.book_columns.rows, self.COMIC_INFO_COLUMNS, self.LOOKUP_TABLE, self.overwrite_all, self.workers, self.shard_size, self.fallback_matching)
+        self.logger.info(f"Matching comics with {self.workers} worker processes.")
+
+        seen_comics = set()
+        seen_books = set()
+        index = 0
+        try:
+            for self.comic_table in self.iter_comic_tables():
+                row_ids = iter(self.comic_table.row_ids)
+                for results in matcher.map(self.comic_table):
+                    if self.is_cancelled():
+                        self.logger.warning(f"Processing cancelled after {index} of {total_comics} comics, the changes so far are saved.")
+                        return
+
+                    for comic_id, path, result in results:
+                        self.row_id = next(row_ids)
+                        position = result[0] if result is not None else None
+                        with self.metrics.comic_timer():
+                            if comic_id in seen_comics or position in seen_books:
+                                self.process_comic(comic_id, path)
+                            else:
+                                self.process_comic(comic_id, path, result)
+                        self.plan.last_id = self.row_id
+                        seen_comics.add(comic_id)
+                        if position is not None:
+                            seen_books.add(position)
+                    index += len(results)
+                    self.report_progress(index, total_comics)
+        finally:
+            matcher.close()
+
+    def process_comic(self, comic_id, path, result=None):
+        # result: in parallelle modus het door een worker berekende resultaat, zie cr_parallel
+        ambiguous = ()
+        if result is None:
+            book, strategy, ambiguous = self.match_book(comic_id, path)
+        else:
+            book, strategy = self.book_index.books[result[0]], result[1]
+
+        # in incrementele modus: sla de comic over als boek en comic_info sinds de vorige run gelijk zijn
+        if self.state is not None and book is not None and not self.overwrite_all:
+            if self.state.get(comic_id, path) == self.fingerprints(comic_id, path, book):
+                self.number_skipped += 1
+                return
+
+        if book is not None:
+            xmlbook = book.File
+            self.match_counts[strategy] = self.match_counts.get(strategy, 0) + 1
+            if self.debug:
+                self.logger.debug(f"MATCH:  DB path: {path}, met Id {comic_id:>8} --- XML File: {xmlbook} ({strategy})")
+
+            if result is None:
+                self.update_comic_info(comic_id, book, path)
+
+                # sync read status naar ComicRack indien de optie aan staat, anders alleen melden
+                self.sync_read_status(comic_id, book, path)
+            else:
+                _, _, fields_to_update, update_values, last_page_read, conflicts = result
+                self.apply_comic_updates(comic_id, path, fields_to_update, update_values, conflicts)
+                if last_page_read is not None:
+                    self.apply_read_status(book, path, last_page_read, comic_id)
+
+            if self.state is not None:
+                self.state_changes[(comic_id, path)] = self.fingerprints(comic_id, path, book)
+
+        elif ambiguous:
+            self.logger.warning(f"Several ComicRack books match ComicInfoId {comic_id:>8} ({', '.join(ambiguous)}), not updated: {path}")
+            self.number_ambiguous += 1
+
+        else:
+            self.logger.warning(f"No ComicRack info found for ComicInfoId {comic_id:>8}: {path}")
+            self.number_missing += 1
+
     def run(self):
+        # Geeft False terug als de database of het XML bestand niet geopend kon worden
+        if not self.profile_file:
+            return self.convert()
+
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self.convert()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self.profile_file)
+            self.logger.info(f"Profile of the run written to {self.profile_file}.")
+
+    def convert(self):
         self.connect_to_db()
-        self.parse_xml()
-       
-        if not self.conn or not self.root:
+        if not self.conn:
+            return False
+
+        # ook als ComicDB.xml niet gelezen kan worden moet de journal mode teruggezet worden
+        try:
+            # bij meerdere libraries is ComicDB.xml al eenmalig ingelezen en geïndexeerd
+            if self.book_index is None:
+                self.parse_xml()
+            if self.book_index is None:
+                return False
+            if not self.is_cancelled():
+                self.process_comics()
+        finally:
+            self.close_db()
+            self.report_metrics()
+        return True
+
+    def replay(self, plan, other_database=False):
+        # Voer een eerder bewaard ChangePlan opnieuw uit op deze bestanden. Updates voor ComicDB.xml
+        # worden alleen uitgevoerd als het boek op die positie nog hetzelfde bestand is. Een plan van
+        # een andere YAC database wordt alleen met other_database uitgevoerd. Geeft False terug als
+        # het plan niet bij de database hoort of de database of het XML bestand niet geopend kon worden.
+        if not other_database and not plan.belongs_to(self.db_location):
+            self.logger.error(f"The change plan was made for the YAC database {plan.db_location}, not for {os.path.abspath(self.db_location)}; use --plan-other-db to apply it anyway.")
+            return False
+
+        self.connect_to_db()
+        if not self.conn:
+            return False
+
+        try:
+            self.plan = plan
+            if plan.xml_updates:
+                self.parse_xml()
+                if self.book_index is None:
+                    return False
+                self.check_xml_updates(plan)
+            self.logger.info(f"Replaying change plan: {len(plan.yac_updates)} comic updates for YAC, {len(plan.xml_updates)} read status changes for ComicRack.")
+            self.apply_plan(plan)
+            self.number_syncread = len(plan.xml_updates)
+            self.logger.info(f"Replay completed; {self.number_updated} comics updated, {self.number_syncread} read status changes in ComicRack.")
+        finally:
+            self.close_db()
+        return True
+
+    def check_xml_updates(self, plan):
+        books = self.book_index.books
+        for position, (file_name, last_page_read) in list(plan.xml_updates.items()):
+            if position >= len(books) or books[position].File != file_name:
+                self.logger.warning(f"ComicDB.xml changed since the plan was made, read status not updated for {file_name}")
+                del plan.xml_updates[position]
+            else:
+                books[position].LastPageRead = last_page_read
+
+    def report_metrics(self):
+        # Rapport met de metingen van de run, als JSON in metrics_file en samengevat in de log
+        report = self.metrics.report()
+        if report is None:
             return
 
-        self.process_comics()
-        self.conn.close()
+        phases = ", ".join(f"{phase} {values['seconds']:.3f}s" for phase, values in report['phases'].items())
+        self.logger.info(f"Metrics: {report['total_seconds']:.3f}s total ({phases}), {report['sql_statements']} SQL statements.")
+        if self.metrics_file:
+            try:
+                with open(self.metrics_file, 'w') as metrics_file:
+                    metrics_file.write(self.metrics.to_json())
+            except OSError as e:
+                self.logger.warning(f"Could not write the metrics to {self.metrics_file}: {e}")
+
+    def summary(self):
+        # Tellers van de laatste run
+        return {
+            'updated': self.number_updated,
+            'unchanged': self.number_nochange,
+            'missing': self.number_missing,
+            'ambiguous': self.number_ambiguous,
+            'syncread': self.number_syncread,
+            'skipped': self.number_skipped,
+            'conflicts': len(self.plan.conflicts) if self.plan is not None else 0,
+            'failed': self.writer.failed if self.writer is not None else 0,
+        }
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import sys
+
+# Journal modes die via journal_mode ingesteld kunnen worden; een lege waarde laat de database ongemoeid
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'wal')
+
+# Bestandssystemen waarop WAL en mmap niet veilig zijn, het gedeelde geheugen werkt alleen lokaal
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'fuse.sshfs', 'afs')
+
+# Toegangspaden die de conversie nodig heeft: (tabel, kolom, nodig voor elke update)
+ACCESS_PATHS = (
+    ('comic_info', 'Id', True),
+    ('comic', 'ComicInfoId', False),
+)
+
+def is_busy(error):
+    # De database is vergrendeld door een ander proces, zoals YACReader
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+def is_network_path(path):
+    path = os.path.abspath(path)
+    if path.startswith('\\\\') or path.startswith('//'):
+        return True
+
+    if sys.platform == 'win32':
+        import ctypes
+        drive = os.path.splitdrive(path)[0]
+        DRIVE_REMOTE = 4
+        return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == DRIVE_REMOTE
+
+    # zoek het langste mount point dat het pad bevat
+    try:
+        with open('/proc/mounts') as mounts:
+            mount_points = [line.split()[1:3] for line in mounts]
+    except OSError:
+        return False
+    filesystem, longest = None, -1
+    for mount_point, mount_type in mount_points:
+        mount_point = mount_point.replace('\\040', ' ')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > longest:
+            filesystem, longest = mount_type, len(mount_point)
+    return filesystem in NETWORK_FILESYSTEMS
+
+def missing_indexes(conn):
+    # Levert de toegangspaden uit ACCESS_PATHS waarvoor SQLite de hele tabel moet doorlopen
+    missing = []
+    for table, column, required in ACCESS_PATHS:
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT 1 FROM {table} WHERE {column} = ?", (0,)).fetchall()
+        except sqlite3.Error:
+            continue
+        if any(row[-1].startswith('SCAN') for row in plan):
+            missing.append((table, column, required))
+    return missing
+
+class ConnectionProfile:
+    # Instellingen voor de verbinding met de YAC database. cache_size, mmap_size, temp_store en
+    # synchronous gelden alleen voor deze verbinding; alleen de journal mode wordt in de database
+    # bewaard en wordt bij het sluiten teruggezet. WAL en mmap worden niet gebruikt op een
+    # netwerkschijf, en in een dry run wordt de journal mode niet aangepast.
+    def __init__(self, journal_mode='wal', cache_size_mb=64, mmap_size_mb=256, temp_store_memory=True, busy_timeout=5000, dry_run=False):
+        self.journal_mode = journal_mode.strip().lower()
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        self.temp_store_memory = temp_store_memory
+        self.busy_timeout = busy_timeout    # in milliseconden
+        self.dry_run = dry_run
+        self.original_journal_mode = None   # gezet als de journal mode is aangepast
+
+    def connect(self, db_location, logger):
+        conn = sqlite3.connect(db_location, timeout=self.busy_timeout / 1000)
+        try:
+            self.apply(conn, db_location, logger)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not apply the connection settings to the YAC database: {e}")
+        return conn
+
+    def apply(self, conn, db_location, logger):
+        network = is_network_path(db_location)
+        if self.cache_size_mb:
+            # een negatieve cache_size is in KiB in plaats van pagina's
+            conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_mb) * 1024}")
+        if self.mmap_size_mb and not network:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size_mb) * 1024 * 1024}")
+        if self.temp_store_memory:
+            conn.execute("PRAGMA temp_store = MEMORY")
+
+        if not self.journal_mode or self.dry_run:
+            return
+        if self.journal_mode not in JOURNAL_MODES:
+            logger.warning(f"Unknown journal_mode '{self.journal_mode}', the journal mode of the YAC database is not changed.")
+            return
+        if self.journal_mode == 'wal' and network:
+            logger.info("The YAC database is on a network drive, WAL is not used.")
+            return
+
+        current = conn.execute("PRAGMA journal_mode").fetchone()[0].lower()
+        if current == self.journal_mode:
+            return
+        try:
+            mode = conn.execute(f"PRAGMA journal_mode = {self.journal_mode}").fetchone()[0].lower()
+        except sqlite3.Error as e:
+            logger.info(f"Journal mode of the YAC database not changed to {self.journal_mode}: {e}")
+            return
+        if mode != self.journal_mode:
+            logger.info(f"Journal mode of the YAC database not changed to {self.journal_mode}, it is {mode}.")
+            return
+
+        self.original_journal_mode = current
+        if mode == 'wal':
+            # in WAL mode is NORMAL veilig: na een crash gaan hooguit de laatste transacties verloren
+            conn.execute("PRAGMA synchronous = NORMAL")
+        logger.debug(f"Journal mode of the YAC database changed from {current} to {mode}.")
+
+    def restore(self, conn, logger):
+        # Zet de journal mode terug, zodat YACReader de database aantreft zoals die was
+        if self.original_journal_mode is None:
+            return
+        try:
+            conn.execute(f"PRAGMA journal_mode = {self.original_journal_mode}")
+            logger.debug(f"Journal mode of the YAC database restored to {self.original_journal_mode}.")
+        except sqlite3.Error as e:
+            logger.warning(f"Could not restore the journal mode of the YAC database to {self.original_journal_mode}: {e}")
+        self.original_journal_mode = None
+
+    def close(self, conn, logger):
+        self.restore(conn, logger)
+        conn.close()
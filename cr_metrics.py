@@ -0,0 +1,117 @@
+import json
+import time
+
+# Grenzen van de histogram met de verwerkingstijd per comic, in seconden
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0)
+
+def bucket_name(limit):
+    if limit < 0.001:
+        return f"<{limit * 1000000:g}us"
+    if limit < 1:
+        return f"<{limit * 1000:g}ms"
+    return f"<{limit:g}s"
+
+class Timer:
+    # Context manager die de verstreken tijd doorgeeft aan een functie
+    __slots__ = ('record', 'start')
+
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record(time.perf_counter() - self.start)
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class Metrics:
+    # Verzamelt tijden per fase, het aantal SQL statements, een histogram van de verwerkingstijd
+    # per comic en het aantal updates per veld van de LOOKUP_TABLE.
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}        # fase -> totale tijd in seconden
+        self.calls = {}         # fase -> aantal keer uitgevoerd
+        self.statements = {}    # soort SQL statement (SELECT, UPDATE, ...) -> aantal
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.field_updates = {}
+
+    def timer(self, phase):
+        return Timer(lambda seconds: self.add_time(phase, seconds))
+
+    def comic_timer(self):
+        return Timer(self.add_latency)
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def add_latency(self, seconds):
+        for index, limit in enumerate(LATENCY_BUCKETS):
+            if seconds < limit:
+                self.latency[index] += 1
+                return
+        self.latency[-1] += 1
+
+    def add_statement(self, statement):
+        # trace callback van sqlite3, wordt ook voor elke rij van executemany aangeroepen
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+        self.statements[kind] = self.statements.get(kind, 0) + 1
+
+    def trace(self, conn):
+        conn.set_trace_callback(self.add_statement)
+
+    def count_fields(self, fields):
+        for field in fields:
+            self.field_updates[field] = self.field_updates.get(field, 0) + 1
+
+    def report(self):
+        latency = {bucket_name(limit): count for limit, count in zip(LATENCY_BUCKETS, self.latency)}
+        latency[f">={LATENCY_BUCKETS[-1]:g}s"] = self.latency[-1]
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 6),
+            'phases': {phase: {'seconds': round(seconds, 6), 'calls': self.calls[phase]} for phase, seconds in self.phases.items()},
+            'sql_statements': sum(self.statements.values()),
+            'sql_statements_by_kind': dict(sorted(self.statements.items())),
+            'comics_timed': sum(self.latency),
+            'comic_latency': latency,
+            'field_updates': dict(sorted(self.field_updates.items())),
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+class NullMetrics:
+    # Vervangt Metrics als de metingen uit staan, zodat de conversie geen extra werk doet
+    enabled = False
+
+    def timer(self, phase):
+        return NULL_TIMER
+
+    def comic_timer(self):
+        return NULL_TIMER
+
+    def trace(self, conn):
+        pass
+
+    def count_fields(self, fields):
+        pass
+
+    def report(self):
+        return None
+
+    def to_json(self):
+        return 'null'
@@ -0,0 +1,135 @@
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+
+from cr_converter import CRConverter
+
+class LibraryLogger(logging.LoggerAdapter):
+    # De libraries loggen door elkaar, daarom staat de naam van de library voor elke regel
+    def process(self, msg, kwargs):
+        return f"[{self.extra['library']}] {msg}", kwargs
+
+def library_name(db_location):
+    # Naam van de library voor de log: YAC bewaart library.ydb in <library>/.yacreaderlibrary
+    folder = os.path.dirname(os.path.abspath(db_location))
+    if os.path.basename(folder) == '.yacreaderlibrary':
+        folder = os.path.dirname(folder)
+    return os.path.basename(folder) or db_location
+
+def library_file(file_name, number):
+    # Eigen bestand per library voor het plan en het profiel: plan.json wordt plan-1.json, plan-2.json, ...
+    if not file_name:
+        return None
+    root, extension = os.path.splitext(file_name)
+    return f"{root}-{number}{extension}"
+
+class MultiConverter:
+    # Synchroniseert één ComicDB.xml met meerdere YAC libraries in één run. ComicDB.xml wordt één
+    # keer ingelezen en geïndexeerd, daarna verwerkt elke library in een eigen thread een eigen
+    # CRConverter met een eigen databaseverbinding en writer. De nieuwe LastPageRead waarden van
+    # alle libraries worden aan het einde samen in één keer in ComicDB.xml geschreven.
+    # De parameters zijn die van CRConverter, met een lijst databases in plaats van één.
+    def __init__(self, db_locations, xml_location, progress=None, log_handler=None, overwrite_all=False, log_level=logging.INFO, verbose=False, syncread=False, cancel_event=None, metrics=False, metrics_file=None, profile_file=None, plan_file=None, **options):
+        self.db_locations = list(db_locations)
+        self.xml_location = xml_location
+        self.progress = progress
+        self.syncread = syncread
+        self.metrics_file = metrics_file
+        self.progress_lock = threading.Lock()
+        self.progress_values = {}   # library -> (waarde, maximum) van de voortgang
+        self.completed = {}         # library -> True als de library verwerkt is
+        metrics = bool(metrics or metrics_file)
+
+        # de bron leest ComicDB.xml in en schrijft aan het einde de gelezen status terug
+        self.source = CRConverter(self.db_locations[0], xml_location, None, log_handler, overwrite_all, log_level, verbose, syncread, cancel_event=cancel_event, metrics=metrics, **options)
+        self.logger = self.source.logger
+
+        self.converters = {}
+        for number, db_location in enumerate(self.db_locations, 1):
+            name = library_name(db_location)
+            if name in self.converters:
+                name = f"{name} ({number})"
+            converter = CRConverter(db_location, xml_location, self.library_progress(name), None, overwrite_all, log_level, verbose, syncread, cancel_event=cancel_event, metrics=metrics,
+                                    profile_file=library_file(profile_file, number), plan_file=library_file(plan_file, number), **options)
+            converter.defer_xml = True
+            converter.logger = LibraryLogger(converter.logger, {'library': name})
+            self.converters[name] = converter
+
+    def library_progress(self, name):
+        # Voortgang van alle libraries samen; wordt vanuit de threads van de libraries aangeroepen
+        def report(value, maximum):
+            with self.progress_lock:
+                self.progress_values[name] = (value, maximum)
+                if self.progress is not None:
+                    self.progress(sum(value for value, _ in self.progress_values.values()), sum(maximum for _, maximum in self.progress_values.values()))
+        return report
+
+    def run(self):
+        # Geeft False terug als ComicDB.xml of een van de databases niet geopend kon worden
+        self.completed = {}
+        self.source.parse_xml()
+        if self.source.book_index is None:
+            return False
+
+        # Alleen Sync Read status past de boeken aan; dan krijgt elke library een eigen kopie,
+        # zodat de uitkomst van een library niet afhangt van de andere
+        for converter in self.converters.values():
+            converter.book_index = self.source.book_index.copy() if self.syncread else self.source.book_index
+
+        self.logger.info(f"Processing {len(self.converters)} YAC libraries: {', '.join(self.converters)}.")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.converters)) as executor:
+            futures = {name: executor.submit(converter.run) for name, converter in self.converters.items()}
+
+        for name, future in futures.items():
+            try:
+                self.completed[name] = future.result()
+            except Exception as e:
+                self.logger.error(f"[{name}] There was an error: {e}")
+                self.completed[name] = False
+
+        try:
+            self.write_xml()
+        finally:
+            self.report_metrics()
+        return all(self.completed.values())
+
+    def write_xml(self):
+        # Voeg de nieuwe LastPageRead waarden van de libraries samen; voor hetzelfde boek leveren
+        # alle libraries dezelfde waarde
+        read_status = {}
+        for name, converter in self.converters.items():
+            if self.completed.get(name) and converter.plan is not None:
+                read_status.update(converter.plan.read_status())
+        if not read_status:
+            return
+
+        books = self.source.book_index.books
+        for position, (_, last_page_read) in read_status.items():
+            books[position].LastPageRead = last_page_read
+        self.source.write_xml(read_status)
+
+    def report_metrics(self):
+        # Eén JSON bestand met de metingen van het inlezen van ComicDB.xml en per library
+        self.source.report_metrics()
+        report = self.source.metrics.report()
+        if report is None or not self.metrics_file:
+            return
+
+        libraries = {name: converter.metrics.report() for name, converter in self.converters.items()}
+        try:
+            with open(self.metrics_file, 'w') as metrics_file:
+                json.dump({'xml': report, 'libraries': libraries}, metrics_file, indent=2)
+        except OSError as e:
+            self.logger.warning(f"Could not write the metrics to {self.metrics_file}: {e}")
+
+    def summary(self):
+        # Tellers van de laatste run per verwerkte library
+        return {name: converter.summary() for name, converter in self.converters.items() if self.completed.get(name)}
+
+def create_converter(db_locations, xml_location, *args, **kwargs):
+    # Eén library: de gewone CRConverter, meerdere libraries: MultiConverter
+    if len(db_locations) == 1:
+        return CRConverter(db_locations[0], xml_location, *args, **kwargs)
+    return MultiConverter(db_locations, xml_location, *args, **kwargs)
@@ -0,0 +1,81 @@
+import collections
+import concurrent.futures
+
+from cr_comicdb import BookRecord
+from cr_converter import BookColumns, BookIndex, ComicTable, comic_updates, read_status_update, hash_size, date_year
+
+# Gegevens per worker proces, eenmalig gezet door init_worker
+worker_index = None
+worker_columns = None
+worker_book_columns = None
+worker_overwrite_all = False
+
+def init_worker(books, index, book_rows, columns, lookup_table, overwrite_all, fallback=False):
+    # Zet in elk worker proces eenmalig de index en de afgeleide velden van de boeken uit ComicDB.xml
+    # neer, zoals het hoofdproces ze heeft opgebouwd; alleen de boeken zelf worden aangemaakt
+    global worker_index, worker_columns, worker_book_columns, worker_overwrite_all
+    worker_index = BookIndex.from_state([BookRecord.from_tuple(book) for book in books], index, fallback)
+    worker_columns = columns
+    worker_book_columns = BookColumns.from_rows(lookup_table, book_rows)
+    worker_overwrite_all = overwrite_all
+
+def process_shard(shard):
+    # Zoek voor elke comic uit de shard het boek op en bepaal de updates voor YAC en de nieuwe
+    # LastPageRead voor ComicRack. Levert per comic (comic_id, path, result), met result None als
+    # er geen boek gevonden is en anders (positie van het boek, strategie, velden, waarden, LastPageRead,
+    # conflicten).
+    table = ComicTable(worker_columns)
+    for comic_id, path, row in shard:
+        table.add(comic_id, path, row)
+
+    results = []
+    for comic_id, path in table.comics:
+        book, strategy, _ = worker_index.match(path, hash_size(table.value(comic_id, 'Hash')), table.value(comic_id, 'Series'), table.value(comic_id, 'Number'),
+                                               table.value(comic_id, 'Volume'), date_year(table.value(comic_id, 'Date')))
+        if book is None:
+            results.append((comic_id, path, None))
+            continue
+
+        conflicts = []
+        fields_to_update, update_values = comic_updates(worker_book_columns, worker_book_columns.row(book), table.row(comic_id), worker_overwrite_all, None, conflicts)
+        if fields_to_update:
+            table.update(comic_id, dict(zip(fields_to_update, update_values)))
+
+        # zonder Sync Read status wordt een verschil in gelezen status als conflict gemeld
+        last_page_read = read_status_update(book, table.value(comic_id, 'Read'))
+
+        results.append((comic_id, path, (book.position, strategy, fields_to_update, update_values, last_page_read, conflicts)))
+    return results
+
+class ParallelMatcher:
+    # Verdeelt de comics in shards over een pool van processen. De resultaten komen in de
+    # oorspronkelijke volgorde terug, zodat ze door één writer verwerkt kunnen worden. Er staan
+    # hooguit twee shards per worker tegelijk uit, zodat het geheugengebruik begrensd blijft.
+    def __init__(self, books, index, book_rows, columns, lookup_table, overwrite_all, workers, shard_size=1000, fallback=False):
+        self.workers = workers
+        self.shard_size = shard_size
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=(books, index, book_rows, columns, lookup_table, overwrite_all, fallback))
+
+    def shards(self, table):
+        shard = []
+        for comic_id, path in table.comics:
+            shard.append((comic_id, path, table.rows[comic_id]))
+            if len(shard) >= self.shard_size:
+                yield shard
+                shard = []
+        if shard:
+            yield shard
+
+    def map(self, table):
+        pending = collections.deque()
+        for shard in self.shards(table):
+            pending.append(self.executor.submit(process_shard, shard))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
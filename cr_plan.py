@@ -0,0 +1,96 @@
+import datetime
+import json
+import os
+
+# Verhoog bij een wijziging in de opbouw van het JSON bestand
+PLAN_VERSION = 1
+
+class PlanError(Exception):
+    # Het plan kan niet gelezen worden of hoort niet bij deze bestanden
+    pass
+
+class ChangePlan:
+    # Alle wijzigingen van een run, eerst volledig berekend en daarna in twee keer uitgevoerd:
+    # de updates voor comic_info in YAC en de nieuwe LastPageRead waarden voor ComicDB.xml.
+    # Conflicten zijn velden die in YAC en ComicRack verschillen, maar volgens de LOOKUP_TABLE
+    # niet overschreven worden; die worden alleen gemeld. Het plan kan als JSON bewaard worden om
+    # het vooraf te bekijken, te vergelijken of later opnieuw uit te voeren.
+    def __init__(self, db_location, xml_location, track_pending=False):
+        self.db_location = os.path.abspath(db_location)
+        self.xml_location = os.path.abspath(xml_location)
+        self.yac_updates = []       # (comic_id, path, velden, waarden) in de volgorde van verwerken
+        self.xml_updates = {}       # positie van het boek -> (File, LastPageRead)
+        self.conflicts = []         # (comic_id, path, veld, waarde in YAC, waarde in ComicRack)
+        self.track_pending = track_pending  # alleen nodig als de comics in delen worden ingelezen
+        self.pending = {}           # comic_id -> {veld: waarde} van de nog niet uitgevoerde updates
+        self.row_ids = []           # comic.Id bij elke update in yac_updates, voor het checkpoint
+        self.last_id = None         # comic.Id van de laatst verwerkte comic
+
+    def belongs_to(self, db_location):
+        # De updates voor YAC gebruiken de Ids uit comic_info en horen alleen bij deze database
+        return os.path.normcase(os.path.abspath(db_location)) == os.path.normcase(self.db_location)
+
+    def add_yac_update(self, comic_id, path, fields, values, row_id=None):
+        self.yac_updates.append((comic_id, path, tuple(fields), tuple(values)))
+        if row_id is not None:
+            self.row_ids.append(row_id)
+        if self.track_pending:
+            self.pending.setdefault(comic_id, {}).update(zip(fields, values))
+
+    def add_xml_update(self, position, file_name, last_page_read):
+        self.xml_updates[position] = (file_name, last_page_read)
+
+    def add_conflict(self, comic_id, path, field, yac_value, comicrack_value):
+        self.conflicts.append((comic_id, path, field, yac_value, comicrack_value))
+
+    def overlay(self, table):
+        # Verwerk de nog niet uitgevoerde updates in een later ingelezen deel van de comic tabel,
+        # zodat comics met dezelfde ComicInfoId de nieuwe waarden zien
+        for comic_id in table.rows.keys() & self.pending.keys():
+            table.update(comic_id, self.pending[comic_id])
+
+    def read_status(self):
+        # (File, LastPageRead) per positie van het boek, zoals write_read_status die verwacht
+        return dict(self.xml_updates)
+
+    def to_dict(self):
+        return {
+            'version': PLAN_VERSION,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'db_location': self.db_location,
+            'xml_location': self.xml_location,
+            'yac_updates': [
+                {'id': comic_id, 'path': path, 'fields': dict(zip(fields, values))}
+                for comic_id, path, fields, values in self.yac_updates],
+            'xml_updates': [
+                {'position': position, 'file': file_name, 'LastPageRead': last_page_read}
+                for position, (file_name, last_page_read) in sorted(self.xml_updates.items())],
+            'conflicts': [
+                {'id': comic_id, 'path': path, 'field': field, 'yac': yac_value, 'comicrack': comicrack_value}
+                for comic_id, path, field, yac_value, comicrack_value in self.conflicts],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != PLAN_VERSION:
+            raise PlanError(f"unsupported plan version {data.get('version')}")
+        plan = cls(data['db_location'], data['xml_location'])
+        for update in data['yac_updates']:
+            plan.add_yac_update(update['id'], update['path'], list(update['fields']), list(update['fields'].values()))
+        for update in data['xml_updates']:
+            plan.add_xml_update(update['position'], update['file'], update['LastPageRead'])
+        for conflict in data['conflicts']:
+            plan.add_conflict(conflict['id'], conflict['path'], conflict['field'], conflict['yac'], conflict['comicrack'])
+        return plan
+
+    def save(self, plan_file):
+        with open(plan_file, 'w', encoding='utf-8') as output:
+            json.dump(self.to_dict(), output, indent=1, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, plan_file):
+        try:
+            with open(plan_file, encoding='utf-8') as plan_input:
+                return cls.from_dict(json.load(plan_input))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            raise PlanError(f"could not read the plan {plan_file}: {e}")
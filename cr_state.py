@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+# STATE_FILE: standaard bestand waarin de staat van de vorige run wordt bewaard
+from cr_config import STATE_FILE
+
+def fingerprint(values):
+    # Compacte, over runs stabiele vingerafdruk van een reeks waarden. Waarden worden als tekst
+    # vergeleken, zodat '20' uit de XML en 20 uit de database dezelfde afdruk geven.
+    text = '\x1f'.join('\x00' if value is None else str(value) for value in values)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big', signed=True)
+
+class SyncState:
+    # Sidecar SQLite bestand met per comic de vingerafdruk van het gematchte boek uit ComicDB.xml
+    # en van de comic_info waarden na de vorige run. Een comic waarvan beide afdrukken gelijk zijn
+    # gebleven hoeft niet opnieuw verwerkt te worden. De staat is per YAC library en wordt
+    # weggegooid als de instellingen die de uitkomst bepalen zijn veranderd.
+    def __init__(self, state_file, library, settings):
+        self.state_file = state_file
+        self.library = os.path.abspath(library)
+        self.settings = fingerprint(settings)
+        self.comics = {}
+
+    def connect(self):
+        conn = sqlite3.connect(self.state_file)
+        conn.execute("CREATE TABLE IF NOT EXISTS library (library TEXT PRIMARY KEY, settings INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS comic (library TEXT, comic_id INTEGER, path TEXT, book INTEGER, comic INTEGER, PRIMARY KEY (library, comic_id, path))")
+        return conn
+
+    def load(self):
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT settings FROM library WHERE library = ?", (self.library,)).fetchone()
+            if row is None or row[0] != self.settings:
+                self.comics = {}
+                return
+            self.comics = {
+                (comic_id, path): (book, comic)
+                for comic_id, path, book, comic in conn.execute("SELECT comic_id, path, book, comic FROM comic WHERE library = ?", (self.library,))
+            }
+        finally:
+            conn.close()
+
+    def get(self, comic_id, path):
+        return self.comics.get((comic_id, path))
+
+    def save(self, changes):
+        # changes: {(comic_id, path): (book, comic)} van de comics die in deze run verwerkt zijn
+        conn = self.connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT settings FROM library WHERE library = ?", (self.library,)).fetchone()
+                if row is None or row[0] != self.settings:
+                    conn.execute("DELETE FROM comic WHERE library = ?", (self.library,))
+                    conn.execute("INSERT OR REPLACE INTO library (library, settings) VALUES (?, ?)", (self.library, self.settings))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO comic (library, comic_id, path, book, comic) VALUES (?, ?, ?, ?, ?)",
+                    ((self.library, comic_id, path, book, comic) for (comic_id, path), (book, comic) in changes.items()))
+        finally:
+            conn.close()
+        self.comics.update(changes)
+
+class Checkpoint:
+    # Voortgang van een lopende run in hetzelfde sidecar bestand: het Id (comic.Id) van de laatste
+    # comic waarvan alle updates gecommit zijn, plus de nog niet in ComicDB.xml geschreven gelezen
+    # status van de run. Wordt na elke gecommitte batch bijgewerkt en na een volledige run
+    # verwijderd. Een afgebroken run kan hiermee na die comic verder gaan. Het opnieuw uitvoeren
+    # van een batch die na de commit maar voor het checkpoint afbrak is onschadelijk, een update
+    # zet alleen waarden.
+    def __init__(self, state_file, library, settings):
+        self.state_file = state_file
+        self.library = os.path.abspath(library)
+        self.settings = fingerprint(settings)
+
+    def connect(self):
+        conn = sqlite3.connect(self.state_file)
+        conn.execute("CREATE TABLE IF NOT EXISTS checkpoint (library TEXT PRIMARY KEY, settings INTEGER, last_id INTEGER, xml_updates TEXT)")
+        return conn
+
+    def load(self):
+        # Levert (last_id, {positie: (File, LastPageRead)}) of None als er geen bruikbaar checkpoint is
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT settings, last_id, xml_updates FROM checkpoint WHERE library = ?", (self.library,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or row[0] != self.settings:
+            return None
+        return row[1], {position: (file_name, last_page_read) for position, file_name, last_page_read in json.loads(row[2])}
+
+    def save(self, last_id, xml_updates):
+        updates = json.dumps([(position, file_name, last_page_read) for position, (file_name, last_page_read) in sorted(xml_updates.items())])
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO checkpoint (library, settings, last_id, xml_updates) VALUES (?, ?, ?, ?)",
+                             (self.library, self.settings, last_id, updates))
+        finally:
+            conn.close()
+
+    def clear(self):
+        if not os.path.exists(self.state_file):
+            return
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM checkpoint WHERE library = ?", (self.library,))
+        finally:
+            conn.close()
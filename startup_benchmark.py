@@ -0,0 +1,137 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Meet de opstarttijd van ComicDBConverter. Voor de scripts wordt met python -X importtime
+# gemeten hoeveel tijd de imports kosten, en of de kern van de converter GUI modules importeert.
+# De GUI en een bevroren executable worden gestart met COMICDBCONVERTER_STARTUP_CHECK, waarna ze
+# het venster tonen en direct stoppen; daarvan wordt de tijd tot het venster gemeten. Met
+# --baseline worden de resultaten vergeleken met een eerdere meting, een regressie geeft exit code 1.
+
+# Modules waarvan de importtijd gemeten wordt
+MODULES = ('ComicDBConverter', 'ComicDBConverterCLI', 'cr_converter', 'cr_multi')
+
+# Modules van de converter die geen GUI mogen importeren
+CORE_MODULES = ('cr_converter', 'cr_multi')
+
+GUI_MODULES = ('tkinter', '_tkinter')
+
+STARTUP_CHECK = 'COMICDBCONVERTER_STARTUP_CHECK'
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+def parse_importtime(output):
+    # Levert {module: (self, cumulatief)} in microseconden uit de uitvoer van -X importtime
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_time), int(cumulative))
+    return modules
+
+def import_times(module, runs):
+    # Elke run in een nieuw proces, zodat er niets uit een eerdere import in het geheugen staat
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                cwd=REPOSITORY, capture_output=True, text=True)
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"}
+        modules = parse_importtime(result.stderr)
+        totals.append(modules[module][1] if module in modules else sum(self_time for self_time, _ in modules.values()))
+
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    return {
+        'import_ms': round(statistics.median(totals) / 1000, 2),
+        'modules': len(modules),
+        'gui_modules': sorted(name for name in modules if name.split('.')[0] in GUI_MODULES),
+        'slowest_ms': {name: round(self_time / 1000, 2) for name, (self_time, _) in slowest},
+    }
+
+def window_time(command, runs):
+    # Tijd tot het venster getoond is, voor het script of een bevroren executable
+    environment = dict(os.environ, **{STARTUP_CHECK: '1'})
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(command, cwd=REPOSITORY, env=environment, capture_output=True, text=True, timeout=120)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return {'error': str(e)}
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"}
+        times.append(time.perf_counter() - start)
+    return {'window_ms': round(statistics.median(times) * 1000, 1)}
+
+def regressions(report, baseline, tolerance):
+    # Metingen die meer dan tolerance (fractie) trager zijn dan in de baseline
+    found = []
+    for section in ('imports', 'window'):
+        for name, result in report[section].items():
+            before = baseline.get(section, {}).get(name, {})
+            for key in ('import_ms', 'window_ms'):
+                if key in result and key in before and result[key] > before[key] * (1 + tolerance):
+                    found.append(f"{section} {name}: {key} {before[key]} -> {result[key]}")
+    return found
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the startup time of ComicDBConverter, as a script and as a frozen executable.")
+    parser.add_argument('--runs', type=int, default=5, help="number of runs per measurement, the median is reported (default: %(default)s)")
+    parser.add_argument('--exe', action='append', default=[], help="frozen executable to measure, e.g. dist/ComicDBConverter.exe; can be repeated")
+    parser.add_argument('--no-window', action='store_true', help="only measure the imports, without starting the GUI (for systems without a display)")
+    parser.add_argument('--baseline', help="JSON file of an earlier run; slower results fail the benchmark")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown compared to the baseline (default: %(default)s)")
+    parser.add_argument('--output', default='startup.json', help="JSON file with the results (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    imports = {}
+    for module in MODULES:
+        imports[module] = import_times(module, args.runs)
+        result = imports[module]
+        if 'error' in result:
+            print(f"{module:>20}: {result['error']}")
+        else:
+            print(f"{module:>20}: {result['import_ms']:.1f} ms imports, {result['modules']} modules, slowest: {', '.join(list(result['slowest_ms'])[:3])}")
+
+    window = {}
+    if not args.no_window:
+        window['ComicDBConverter.py'] = window_time([sys.executable, 'ComicDBConverter.py'], args.runs)
+    for exe in args.exe:
+        window[exe] = window_time([os.path.abspath(exe)], args.runs)
+    for name, result in window.items():
+        print(f"{name:>20}: " + (f"{result['window_ms']:.0f} ms to the window" if 'window_ms' in result else result['error']))
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'imports': imports,
+        'window': window,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    failures = [f"{module} imports {', '.join(imports[module]['gui_modules'])}" for module in CORE_MODULES
+                if module in imports and imports[module].get('gui_modules')]
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            failures += regressions(report, json.load(baseline), args.tolerance)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
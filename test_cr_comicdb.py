@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from cr_comicdb import ScanError, read_books, scan_books
+
+# Vergelijkt de snelle scanner met ElementTree: voor elk bestand moet scan_books dezelfde boeken
+# leveren als read_books, of ScanError geven zodat de converter terugvalt op ElementTree.
+
+COMICDB = '''<?xml version="1.0"?>
+<ComicDatabase xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <Books>
+    <Book Id="1" File="D:\\Comics\\Batman &amp; Robin\\Batman 001.cbz">
+      <Series>Batman &amp; Robin</Series>
+      <Number>1</Number>
+      <Volume>2009</Volume>
+      <Title>Batman Reborn &#8211; part 1</Title>
+      <Pages>
+        <Page Image="0" Type="FrontCover" />
+      </Pages>
+      <PageCount>32</PageCount>
+      <LastPageRead/>
+    </Book>
+    <Book File="D:\\Comics\\empty.cbz" />
+    <Book File='D:\\Comics\\quotes.cbz'><Title></Title><Year>2011</Year></Book>
+  </Books>
+</ComicDatabase>
+'''
+
+class ScanBooksTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.xml_location = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.xml_location)
+
+    def write(self, data):
+        with open(self.xml_location, 'wb') as xml_file:
+            xml_file.write(data)
+
+    def assert_same_books(self, data):
+        self.write(data)
+        expected = [book.to_tuple() for book in read_books(self.xml_location)[1]]
+        self.assertEqual([book.to_tuple() for book in scan_books(self.xml_location)], expected)
+        return expected
+
+    def test_same_books_as_elementtree(self):
+        books = self.assert_same_books(COMICDB.encode('utf-8'))
+        self.assertEqual(len(books), 3)
+
+    def test_crlf_and_utf8_bom(self):
+        self.assert_same_books(b'\xef\xbb\xbf' + COMICDB.replace('\n', '\r\n').encode('utf-8'))
+
+    def test_books_outside_the_root_books_are_ignored(self):
+        data = COMICDB.replace('<Books>', '<Lists><Books><Book File="z"/></Books></Lists>\n  <Books>', 1)
+        books = self.assert_same_books(data.encode('utf-8'))
+        self.assertNotIn('z', [book[0] for book in books])
+
+    def test_utf16_falls_back(self):
+        for data in (COMICDB.replace('"1.0"?>', '"1.0" encoding="utf-16"?>', 1).encode('utf-16'),
+                     COMICDB.encode('utf-16'), COMICDB.encode('utf-16-le')):
+            self.write(data)
+            with self.assertRaises(ScanError):
+                scan_books(self.xml_location)
+
+    def test_no_books_falls_back(self):
+        for data in (b'<ComicDatabase><Lists><Books><Book File="z"/></Books></Lists></ComicDatabase>',
+                     b'<ComicDatabase><Books/></ComicDatabase>'):
+            self.write(data)
+            with self.assertRaises(ScanError):
+                scan_books(self.xml_location)
+
+if __name__ == '__main__':
+    unittest.main()